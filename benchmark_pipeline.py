@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+# Stages in the order they run; each one is timed on its own
+STAGES = ["qr_encode", "metadata_load", "compositing", "front_pdf", "back_pdf"]
+DECK_SIZES = [100, 1000, 10000, 50000]
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmark_baseline.json")
+
+
+def synthetic_track(i):
+    """Build a fake Spotify track object for the i-th card"""
+    track_id = f"{i:022d}"
+    return {
+        "id": track_id,
+        "name": f"Synthetic Song Number {i} (Remastered)",
+        "artists": [{"name": f"Benchmark Artist {i % 97}"}],
+        "album": {"name": f"Album {i % 31}", "release_date": f"{1950 + i % 75}-01-01"},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def directory_size(path):
+    """Total size in bytes of the files directly inside path"""
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def run_deck(size, workdir):
+    """Run every stage on a synthetic deck of size tracks inside workdir"""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    os.makedirs("qr_codes")
+    os.makedirs("pdf")
+    os.symlink(os.path.join(REPO_DIR, "background"), "background")
+    os.symlink(os.path.join(REPO_DIR, "font.ttf"), "font.ttf")
+
+    import create_qr_pdf
+    import spotify_qr_downloader
+    from metadata_store import write_metadata_store
+    from reportlab.pdfgen import canvas
+
+    create_qr_pdf.register_fonts()
+    background_images = [
+        os.path.join("background", f) for f in sorted(os.listdir("background"))
+    ]
+    tracks = [synthetic_track(i) for i in range(size)]
+
+    stages = {}
+
+    def timed(name, func):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func()
+        stages[name] = {
+            "wall_s": round(time.perf_counter() - wall, 3),
+            "cpu_s": round(time.process_time() - cpu, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        return result
+
+    def qr_encode():
+        records = []
+        for track in tracks:
+            base_filename = f"qr_codes/{track['id']}"
+            spotify_qr_downloader.create_track_files(track, base_filename)
+            records.append(
+                spotify_qr_downloader.build_track_metadata(
+                    track, track["id"], base_filename
+                )
+            )
+        write_metadata_store(records)
+
+    def compositing():
+        # Downsample the backgrounds and draw them as form XObjects, the way
+        # the front PDF does, on a canvas that is never saved
+        c = canvas.Canvas(os.devnull)
+        for page, slot, (x, y), _, _ in create_qr_pdf.iter_layout(deck):
+            background = create_qr_pdf.background_for_card(
+                background_images, page * create_qr_pdf.CARDS_PER_PAGE + slot
+            )
+            create_qr_pdf.draw_background(c, background, x, y)
+
+    timed("qr_encode", qr_encode)
+    deck = timed("metadata_load", create_qr_pdf.load_deck)
+    timed("compositing", compositing)
+    timed("front_pdf", lambda: create_qr_pdf.create_qr_codes_pdf(background_images))
+    timed("back_pdf", lambda: create_qr_pdf.create_metadata_pdf(background_images))
+
+    return {
+        "stages": stages,
+        "outputs": {
+            "qr_codes_bytes": directory_size("qr_codes"),
+            "front_pdf_bytes": os.path.getsize("pdf/qr_codes_front.pdf"),
+            "back_pdf_bytes": os.path.getsize("pdf/metadata_back.pdf"),
+        },
+    }
+
+
+def benchmark(size):
+    """Benchmark one deck size in a fresh process so peak RSS is its own"""
+    workdir = tempfile.mkdtemp(prefix=f"deck_{size}_")
+    try:
+        with get_context("spawn").Pool(1) as pool:
+            return pool.apply(run_deck, (size, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, threshold):
+    """List every metric that got worse than baseline by more than threshold"""
+    regressions = []
+    for size, result in results.items():
+        if size not in baseline:
+            continue
+        metrics = {
+            f"{stage}.{key}": value
+            for stage, values in result["stages"].items()
+            for key, value in values.items()
+        }
+        metrics.update(result["outputs"])
+        base_metrics = {
+            f"{stage}.{key}": value
+            for stage, values in baseline[size]["stages"].items()
+            for key, value in values.items()
+        }
+        base_metrics.update(baseline[size]["outputs"])
+
+        for name, value in metrics.items():
+            base = base_metrics.get(name)
+            # Ignore timings too short to compare reliably
+            if not base or (name.endswith("_s") and base < 0.05):
+                continue
+            if value > base * (1 + threshold):
+                regressions.append(
+                    f"{size} tracks, {name}: {value} vs baseline {base} "
+                    f"(+{(value / base - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def print_results(results):
+    for size, result in results.items():
+        print(f"\n{size} tracks")
+        for stage in STAGES:
+            values = result["stages"][stage]
+            print(
+                f"  {stage:<14} {values['wall_s']:>9.3f}s wall "
+                f"{values['cpu_s']:>9.3f}s cpu {values['peak_rss_mb']:>8.1f} MB peak"
+            )
+        for name, value in result["outputs"].items():
+            print(f"  {name:<18} {value / 1024:>10.0f} KB")
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Benchmark the deck pipeline on synthetic decks"
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DECK_SIZES,
+        help="deck sizes to benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_PATH,
+        help="baseline results to compare against (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed relative slowdown or growth before failing (default: 0.25)",
+    )
+    parser.add_argument("--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        print(f"Benchmarking a deck of {size} tracks...")
+        results[str(size)] = benchmark(size)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print("\nRegressions against the baseline:")
+        for regression in regressions:
+            print(f" - {regression}")
+        return 1
+    print("\nNo regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
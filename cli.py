@@ -0,0 +1,50 @@
+import argparse
+import importlib
+import sys
+
+# Subcommand -> (module, function, help). A module is only imported once its
+# subcommand runs, so startup never pays for reportlab, numpy or spotipy
+# unless they are needed.
+COMMANDS = {
+    "download": (
+        "spotify_qr_downloader",
+        "cli",
+        "generate QR codes and metadata for Spotify playlists",
+    ),
+    "pdf": ("create_qr_pdf", "cli", "create printable PDFs of the cards"),
+    "relayout": (
+        "label_layout",
+        "cli",
+        "recompute the label layout stored with the track metadata",
+    ),
+    "pipeline": (
+        "pipeline",
+        "cli",
+        "run every step from download to PDFs, skipping unchanged ones",
+    ),
+    "benchmark": (
+        "benchmark_pipeline",
+        "main",
+        "benchmark the deck pipeline on synthetic decks",
+    ),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="schnickenriester",
+        description="Turn Spotify playlists into printable music quiz cards",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+    for name, (_, _, help_text) in COMMANDS.items():
+        # Options are parsed by the subcommand itself
+        subparsers.add_parser(name, help=help_text, add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    module_name, function_name, _ = COMMANDS[args.command]
+    run = getattr(importlib.import_module(module_name), function_name)
+    return run(rest, prog=f"{parser.prog} {args.command}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
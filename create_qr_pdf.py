@@ -1,12 +1,38 @@
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
+from reportlab.lib.units import inch, mm
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
+import argparse
+import hashlib
 import json
+import math
 import os
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 import PIL
 import numpy as np
+import re
+from label_layout import ensure_label_layout
+from metadata_store import (
+    METADATA_STORE_PATH,
+    deck_path,
+    read_deck,
+    read_metadata_store,
+)
+from profiling import PROFILER, add_profile_arguments
+from qr_cache import qr_cache_path
+from qr_render import (
+    QR_MODES,
+    matrix_from_png,
+    matrix_runs,
+    qr_matrix,
+    scale_matrix,
+)
 
 
 def register_custom_font(font_path, font_name):
@@ -24,6 +50,12 @@ def register_custom_font(font_path, font_name):
         return False
 
 
+@lru_cache(maxsize=4096)
+def measure_text_width(text, font_name, font_size):
+    """Measure text width in points from the font metrics"""
+    return pdfmetrics.stringWidth(text, font_name, font_size)
+
+
 def wrap_text_to_lines(text, font_name, font_size, max_width):
     """Wrap text to fit within max_width, breaking at spaces"""
     if not text:
@@ -37,13 +69,9 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
     current_line = ""
 
     for word in words:
-        # Create a canvas to measure text width
-        temp_canvas = canvas.Canvas("temp_measure.pdf", pagesize=(100, 100))
-        temp_canvas.setFont(font_name, font_size)
-
         # Test if adding this word would exceed max_width
         test_line = current_line + (" " if current_line else "") + word
-        test_width = temp_canvas.stringWidth(test_line, font_name, font_size)
+        test_width = measure_text_width(test_line, font_name, font_size)
 
         if test_width <= max_width:
             current_line = test_line
@@ -57,9 +85,6 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
                 lines.append(word[:30])  # Fallback truncation
                 current_line = ""
 
-        temp_canvas.save()
-        os.remove("temp_measure.pdf")  # Clean up temp file
-
     # Add the last line if it has content
     if current_line:
         lines.append(current_line)
@@ -67,48 +92,28 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
     return lines if lines else [""]
 
 
-def wrap_text_by_char_limit(text, max_line_chars=10, max_lines=3):
-    """Wrap text by character count per line, breaking at spaces.
-    Returns up to max_lines lines; does not exceed max_line_chars per line.
-    """
-    if not text:
-        return [""]
-    words = text.split()
-    if not words:
-        return [""]
-    lines = []
-    current_line = ""
-    for word in words:
-        candidate = current_line + (" " if current_line else "") + word
-        if len(candidate) <= max_line_chars:
-            current_line = candidate
-        else:
-            if current_line:
-                lines.append(current_line)
-                if len(lines) == max_lines:
-                    break
-                current_line = (
-                    word if len(word) <= max_line_chars else word[:max_line_chars]
-                )
-            else:
-                # Single word longer than max_line_chars: hard-cut
-                lines.append(word[:max_line_chars])
-                if len(lines) == max_lines:
-                    current_line = ""
-                    break
-                current_line = ""
-    if current_line and len(lines) < max_lines:
-        lines.append(current_line)
-    return lines
-
-
 # Constants for layout
 PAGE_WIDTH, PAGE_HEIGHT = A4
 QR_SIZE = 50 * mm  # Shortened card length due to larger font size
 COLS = 4
 ROWS = 5
+CARDS_PER_PAGE = COLS * ROWS
 SPACING = 0 * mm
 
+# Write image and page streams as raw binary; the pure Python ASCII85 encoder
+# is slow and inflates every stream by a quarter
+rl_config.useA85 = 0
+
+# Resolution the front side cards are rendered at
+PRINT_DPI = 300
+CARD_PIXELS = round(QR_SIZE / inch * PRINT_DPI)
+
+# Backgrounds downsampled to the card size are kept here between runs
+ASSET_CACHE_DIR = "cache/assets"
+# How backgrounds are embedded: "png" is lossless, "jpeg" much smaller
+IMAGE_FORMATS = {"png": ".png", "jpeg": ".jpg"}
+JPEG_QUALITY = 90
+
 MARGIN = int((A4[0] - (COLS * QR_SIZE + (COLS - 1) * SPACING)) / 2)
 
 
@@ -121,223 +126,686 @@ def calc_positions():
     return x_positions, y_positions
 
 
-def create_qr_codes_pdf(background_images=None):
-    """Create PDF with just QR codes"""
-    c = canvas.Canvas("pdf/qr_codes_front.pdf", pagesize=A4)
+@lru_cache(maxsize=None)
+def prepare_background(background_image, image_format="png"):
+    """Downsample a background to CARD_PIXELS once and cache it as image_format
 
-    x_positions, y_positions = calc_positions()
+    The cached file is named after a hash of the source and the output
+    settings, so an edited background is prepared again. Returns its path.
+    """
+    with open(background_image, "rb") as f:
+        settings = f"{CARD_PIXELS}:{image_format}:{JPEG_QUALITY}".encode()
+        key = hashlib.sha256(f.read() + settings).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(background_image))[0]
+    path = os.path.join(ASSET_CACHE_DIR, f"{name}_{key}{IMAGE_FORMATS[image_format]}")
+    if os.path.exists(path):
+        return path
+
+    image = PIL.Image.open(background_image)
+    PROFILER.count("images_decoded")
+    # Keep an alpha channel only when it is used, JPEG cannot store one anyway
+    opaque = image.convert("RGBA").getchannel("A").getextrema()[0] == 255
+    mode = "RGB" if opaque or image_format == "jpeg" else "RGBA"
+    image = image.convert(mode).resize((CARD_PIXELS, CARD_PIXELS), PIL.Image.LANCZOS)
+    PROFILER.count("images_resized")
+
+    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if image_format == "jpeg":
+        image.save(tmp_path, "JPEG", quality=JPEG_QUALITY)
+    else:
+        image.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, path)
+    PROFILER.count("files_written")
+    return path
+
+
+class VolumeCanvas:
+    """Canvas that continues in a new numbered file every pages_per_volume pages
+
+    qr_codes_front.pdf becomes qr_codes_front_001.pdf, qr_codes_front_002.pdf,
+    ... and each volume is saved as soon as it is full, so memory stays flat
+    however big the deck is. Without pages_per_volume a single file is written.
+    Everything else is passed through to the current reportlab canvas.
+    """
 
-    qr_files = sorted([f for f in os.listdir("qr_codes") if f.endswith(".png")])
-    qr_files = [f for f in qr_files if not f.endswith("_combined.png")]
-    current_qr = 0
-
-    while current_qr < len(qr_files):
-        for y in y_positions:
-            for x in x_positions:
-                if current_qr < len(qr_files):
-                    # Select background image based on QR number (cycle every 10 songs)
-                    if background_images and len(background_images) > 0:
-                        background_index = (current_qr // 10) % len(background_images)
-                        background_image = background_images[background_index]
-
-                        # Draw background image with proper scaling to fill the card
-                        qr_pil = PIL.Image.open(
-                            f"qr_codes/{qr_files[current_qr]}"
-                        ).convert("RGB")
-                        background_pil = (
-                            PIL.Image.open(background_image)
-                            .convert("RGB")
-                            .resize(qr_pil.size)
-                        )
-
-                        # Replace white pixels in QR with background
-                        array_bg = np.array(background_pil)
-                        array_qr = np.array(qr_pil)  # Ensure QR is RGB
-                        # Make white pixels transparent in QR code
-                        white = array_qr.sum(axis=(2)) > 300
-                        array_qr[white] = array_bg[white]
-
-                        PIL.Image.fromarray(array_qr).save(
-                            f"qr_codes/{qr_files[current_qr]}_combined.png"
-                        )
-
-                        c.drawImage(
-                            f"qr_codes/{qr_files[current_qr]}_combined.png",
-                            x,
-                            y,
-                            QR_SIZE,
-                            QR_SIZE,
-                            mask="auto",
-                            preserveAspectRatio=True,
-                        )
-                    current_qr += 1
-                else:
-                    break
-
-        if current_qr < len(qr_files):
-            c.showPage()
-
-    c.save()
-
-
-def remove_metainfo_text(title_text):
-    # Enforce hard title length limit
-    title_text = title_text.split("-")[0].strip()
-    temp = title_text.split(".")
-    if len(temp) <= 2:
-        title_text = temp[0].strip()
-    title_text = title_text.split(",")[0].strip()
-    title_text = title_text.split("(")
-    if len(title_text) > 1:
-        if len(title_text[0]) > 5:
-            title_text = title_text[0]
+    def __init__(self, path, pages_per_volume=None):
+        self.path = path
+        self.pages_per_volume = pages_per_volume
+        self.paths = []
+        self._pages = 0
+        self._canvas = self._open_volume()
+
+    def _open_volume(self):
+        if self.pages_per_volume:
+            root, ext = os.path.splitext(self.path)
+            path = f"{root}_{len(self.paths) + 1:03d}{ext}"
         else:
-            title_text = title_text[1]
-    else:
-        title_text = title_text[0]
-    return title_text
+            path = self.path
+        self.paths.append(path)
+        return canvas.Canvas(path, pagesize=A4, pageCompression=1)
+
+    def __getattr__(self, name):
+        return getattr(self._canvas, name)
+
+    def _save_volume(self):
+        self._canvas.save()
+        PROFILER.count("files_written")
+        PROFILER.count("pdf_bytes", os.path.getsize(self.paths[-1]))
+
+    def showPage(self):
+        self._pages += 1
+        if self.pages_per_volume and self._pages % self.pages_per_volume == 0:
+            self._save_volume()
+            print(f"Finished volume: {self.paths[-1]}")
+            self._canvas = self._open_volume()
+        else:
+            self._canvas.showPage()
+
+    def save(self):
+        self._save_volume()
 
 
-def create_metadata_pdf(background_images=None):
-    """Create PDF with metadata"""
-    c = canvas.Canvas("pdf/metadata_back.pdf", pagesize=A4)
+def background_for_card(background_images, index):
+    """Select the background of a card (cycles every 10 songs)"""
+    if not background_images:
+        return None
+    return background_images[(index // 10) % len(background_images)]
 
-    # Calculate positions (same as QR codes for alignment)
+
+def draw_background(c, background_image, x, y, image_format="png"):
+    """Draw a card background from a form XObject embedded once per document
+
+    The background is embedded at print resolution; JPEG files are passed
+    through to the PDF as they are.
+    """
+    asset = prepare_background(background_image, image_format)
+    form_name = "Background_" + re.sub(r"\W", "_", asset)
+    if not c.hasForm(form_name):
+        c.beginForm(form_name, 0, 0, QR_SIZE, QR_SIZE)
+        c.drawImage(
+            asset,
+            0,
+            0,
+            QR_SIZE,
+            QR_SIZE,
+            mask="auto",
+            preserveAspectRatio=True,
+        )
+        c.endForm()
+    c.saveState()
+    c.translate(x, y)
+    c.doForm(form_name)
+    c.restoreState()
+
+
+def card_range(pages):
+    """Translate a range of page numbers into a (first, stop) card slice"""
+    if pages is None:
+        return 0, None
+    return pages.start * CARDS_PER_PAGE, pages.stop * CARDS_PER_PAGE
+
+
+def load_deck(deck_name=None):
+    """Load the metadata of every card in card order, with one directory scan
+
+    With deck_name only the tracks listed in that deck file are loaded, and
+    tracks missing from the metadata store are reported. Without a metadata
+    store, the PNG and JSON files written by older versions are paired up by
+    name. A card whose PNG or JSON is missing still keeps its slot, so fronts
+    and backs cannot drift apart.
+    """
+    if deck_name is not None:
+        track_ids = read_deck(deck_name)
+        records = read_metadata_store()
+        missing = [track_id for track_id in track_ids if track_id not in records]
+        if missing:
+            print(
+                f"Warning: {len(missing)} of {len(track_ids)} tracks of deck "
+                f"'{deck_name}' are not in the metadata store and are left out. "
+                "Run the downloader for this playlist again to add them."
+            )
+        deck = [records[track_id] for track_id in track_ids if track_id in records]
+        return sorted(deck, key=lambda record: record["qr_file"])
+
+    if os.path.exists(METADATA_STORE_PATH):
+        records = read_metadata_store().values()
+        return sorted(records, key=lambda record: record["qr_file"])
+
+    files = set(os.listdir("qr_codes"))
+    names = {
+        os.path.splitext(f)[0]
+        for f in files
+        if f.endswith((".png", ".json"))
+        and not f.endswith("_combined.png")
+        and f != "manifest.json"
+    }
+    deck = []
+    for name in sorted(names, key=lambda name: f"{name}.png"):
+        record = {"qr_file": f"{name}.png", "name": name}
+        if f"{name}.json" in files:
+            with open(f"qr_codes/{name}.json", "r", encoding="utf-8") as f:
+                record.update(json.load(f))
+        deck.append(record)
+    return deck
+
+
+def card_matrix(card):
+    """Module matrix of a card's QR code, or None if it has none
+
+    The code is read back from the PNG the downloader left in the QR cache.
+    That file is named after the payload and the QR settings, so it always
+    matches the card. The code is only encoded again when it is not cached.
+    """
+    if card.get("qr_payload"):
+        settings = QR_MODES[card["qr_mode"]]
+        try:
+            return matrix_from_png(
+                qr_cache_path(card["qr_payload"], settings),
+                box_size=settings["box_size"],
+            )
+        except FileNotFoundError:
+            return qr_matrix(card["qr_payload"], card["qr_mode"])
+    if card.get("spotify_url"):
+        return qr_matrix(card["spotify_url"])
+    qr_path = f"qr_codes/{card['qr_file']}"
+    if os.path.exists(qr_path):
+        return matrix_from_png(qr_path)
+    return None
+
+
+def card_layout():
+    """Precompute (front_xy, back_xy) of every slot on a page
+
+    The back side mirrors the columns so that each back lands behind its
+    front when the sheets are printed duplex.
+    """
     x_positions, y_positions = calc_positions()
+    return [
+        ((x, y), (back_x, y))
+        for y in y_positions
+        for x, back_x in zip(x_positions, x_positions[::-1])
+    ]
+
 
-    # Get all JSON files with metadata
-    json_files = sorted([f for f in os.listdir("qr_codes") if f.endswith(".json")])
-    current_item = 0
-
-    while current_item < len(json_files):
-        for y in y_positions:
-            for x in x_positions[::-1]:  # Reverse for back side alignment
-                if current_item < len(json_files):
-                    # Select background image based on item number (cycle every 10 songs)
-                    if background_images and len(background_images) > 0:
-                        background_index = (current_item // 10) % len(background_images)
-                        background_image = background_images[background_index]
-
-                        if os.path.exists(background_image):
-                            # Draw background image with proper scaling to fill the card
-                            c.drawImage(
-                                background_image,
-                                x,
-                                y,
-                                QR_SIZE,
-                                QR_SIZE,
-                                mask="auto",
-                                preserveAspectRatio=True,
-                            )
-
-                    # Load metadata from JSON
-                    with open(
-                        f"qr_codes/{json_files[current_item]}", "r", encoding="utf-8"
-                    ) as f:
-                        metadata = json.load(f)
-
-                    # Sizes
-                    title_artist_size = 12
-                    year_size = 24
-                    gap = 3  # margin from year
-
-                    center_x = x + QR_SIZE / 2
-                    center_y = y + QR_SIZE / 2 - MARGIN / 2
-
-                    year_text = metadata.get("release_year", "Unknown Release Year")
-                    # Draw year at the middle
-                    c.setFont("BauhausBoldBT", year_size)
-                    c.drawCentredString(center_x, center_y, year_text)
-                    # Draw artist below year
-
-                    title_text = remove_metainfo_text(metadata.get("name", "Unknown"))
-
-                    # Wrap song name using 10-char line rule (space-aware)
-                    song_name_lines = wrap_text_by_char_limit(
-                        title_text, max_line_chars=15, max_lines=3
-                    )
-
-                    c.setFont("BauhausBoldBT", title_artist_size)
-                    for idx, line in enumerate(reversed(song_name_lines)):
-                        baseline_text = (
-                            center_y + gap + idx * (title_artist_size + 1) + year_size
-                        )
-                        c.drawCentredString(center_x, baseline_text, line)
-
-                    artist_text = remove_metainfo_text(
-                        metadata.get("artists", ["Unknown Artist"])[0]
-                    )
-                    # Wrap artist name using 10-char line rule (space-aware)
-                    artist_name_lines = wrap_text_by_char_limit(
-                        artist_text, max_line_chars=15, max_lines=3
-                    )
-                    for idx, line in enumerate(artist_name_lines):
-                        baseline_text = (
-                            center_y
-                            - gap
-                            - idx * (title_artist_size + 1)
-                            - title_artist_size
-                        )
-                        c.drawCentredString(center_x, baseline_text, line)
-
-                    current_item += 1
-                else:
-                    break
-        if current_item < len(json_files):
-            c.showPage()
-
-    c.save()
-
-
-def main(background_folder="background"):
-    # Create output directory if it doesn't exist
-    if not os.path.exists("pdf"):
-        os.makedirs("pdf")
-
-    # Register custom font if available
-    custom_font_available = register_custom_font("font.ttf", "BauhausBoldBT")
-    if not custom_font_available:
-        # Try alternative font file names
-        alternative_names = [
-            "fonts/BauhausBoldBT.ttf",
-            "fonts/BauhausBoldBT.otf",
-            "fonts/BauhausBoldBT.woff",
-            "fonts/bauhaus_bold_bt.ttf",
-            "fonts/bauhaus_bold_bt.otf",
-            "BauhausBoldBT.ttf",
-            "BauhausBoldBT.otf",
+def iter_layout(cards, first_card=0):
+    """Yield (page, slot, front_xy, back_xy, card) for every card"""
+    layout = card_layout()
+    for index, card in enumerate(cards, first_card):
+        page, slot = divmod(index, CARDS_PER_PAGE)
+        front_xy, back_xy = layout[slot]
+        yield page, slot, front_xy, back_xy, card
+
+
+def draw_qr_vector(c, matrix, x, y, size):
+    """Draw a QR module matrix as filled rectangles, one per run of dark modules"""
+    module = size / matrix.shape[0]
+    path = c.beginPath()
+    for row, start, length in matrix_runs(matrix):
+        path.rect(
+            x + start * module, y + size - (row + 1) * module, length * module, module
+        )
+    c.setFillColorRGB(0, 0, 0)
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def draw_qr_image(c, matrix, x, y, size):
+    """Draw a QR module matrix as an image at print resolution
+
+    The image only has black and white pixels and white is masked out, so
+    whatever is underneath shows through the light modules.
+    """
+    mask = scale_matrix(matrix, CARD_PIXELS)
+    image = PIL.Image.fromarray(np.where(mask, np.uint8(0), np.uint8(255)), "L")
+    c.drawImage(ImageReader(image), x, y, size, size, mask=[255, 255])
+
+
+def save_combined(card, matrix, background_image, image_format):
+    """Save a card's QR code composited over its background, for debugging"""
+    size = (CARD_PIXELS, CARD_PIXELS)
+    if background_image is None:
+        combined = PIL.Image.new("RGB", size, "white")
+    else:
+        prepared = prepare_background(background_image, image_format)
+        combined = PIL.Image.open(prepared).convert("RGB")
+        PROFILER.count("images_decoded")
+    dark = PIL.Image.fromarray(scale_matrix(matrix, CARD_PIXELS))
+    combined.paste((0, 0, 0), (0, 0, *size), dark)
+    # A palette is plenty for a background plus black modules
+    combined.quantize(256).save(f"qr_codes/{card['qr_file']}_combined.png")
+    PROFILER.count("files_written")
+
+
+def draw_front_page(
+    c, page_cards, background_images, keep_combined, vector, image_format="png"
+):
+    """Draw the QR code side of one page of laid out cards
+
+    Every background is embedded once per document at print resolution, and
+    each QR code is drawn on top of it: as a masked black and white image, or
+    with vector set as vector rectangles. With keep_combined set, each card is
+    also composited and saved as a _combined.png for debugging.
+    """
+    for page, slot, (x, y), _, card in page_cards:
+        background_image = background_for_card(
+            background_images, page * CARDS_PER_PAGE + slot
+        )
+        if background_image:
+            draw_background(c, background_image, x, y, image_format)
+        matrix = card_matrix(card)
+        if matrix is None:
+            continue
+        if vector:
+            draw_qr_vector(c, matrix, x, y, QR_SIZE)
+        else:
+            draw_qr_image(c, matrix, x, y, QR_SIZE)
+        if keep_combined:
+            save_combined(card, matrix, background_image, image_format)
+
+
+def draw_back_page(c, page_cards, background_images, image_format="png"):
+    """Draw the metadata side of one page of laid out cards"""
+    for page, slot, _, (x, y), card in page_cards:
+        background_image = background_for_card(
+            background_images, page * CARDS_PER_PAGE + slot
+        )
+        if background_image and os.path.exists(background_image):
+            draw_background(c, background_image, x, y, image_format)
+
+        draw_metadata_card(c, card, x, y)
+
+
+def draw_metadata_card(c, metadata, x, y):
+    """Draw year, title and artist of one track centred on a card"""
+    # Sizes
+    title_artist_size = 12
+    year_size = 24
+    gap = 3  # margin from year
+
+    center_x = x + QR_SIZE / 2
+    center_y = y + QR_SIZE / 2 - MARGIN / 2
+
+    year_text = metadata.get("release_year", "Unknown Release Year")
+    # Draw year at the middle
+    c.setFont("BauhausBoldBT", year_size)
+    c.drawCentredString(center_x, center_y, year_text)
+    # Draw artist below year
+
+    # Title and artist come cleaned up and wrapped with the metadata
+    layout = ensure_label_layout(metadata)
+    song_name_lines = layout["title_lines"]
+
+    c.setFont("BauhausBoldBT", title_artist_size)
+    for idx, line in enumerate(reversed(song_name_lines)):
+        baseline_text = center_y + gap + idx * (title_artist_size + 1) + year_size
+        c.drawCentredString(center_x, baseline_text, line)
+
+    artist_name_lines = layout["artist_lines"]
+    for idx, line in enumerate(artist_name_lines):
+        baseline_text = (
+            center_y - gap - idx * (title_artist_size + 1) - title_artist_size
+        )
+        c.drawCentredString(center_x, baseline_text, line)
+
+
+def build_duplex_deck(
+    background_images=None,
+    keep_combined=False,
+    vector=False,
+    pages_per_volume=None,
+    front_output="pdf/qr_codes_front.pdf",
+    back_output="pdf/metadata_back.pdf",
+    pages=None,
+    sides=("front", "back"),
+    deck_name=None,
+    image_format="png",
+):
+    """Create the front and back PDFs in a single pass over the deck
+
+    Both sides are drawn from the same card record and the same layout table,
+    so they always stay in step. Cards are streamed page by page; with
+    pages_per_volume set the output is split into numbered volumes holding
+    the same cards on both sides. With pages (a range of page numbers) only
+    those pages are rendered. With deck_name only the cards of that deck are
+    used. Backgrounds are embedded as image_format ("png" or "jpeg"). Returns
+    the front and back paths written, both empty when there are no cards.
+    """
+    first_card, last_card = card_range(pages)
+    with PROFILER.stage("load_deck"):
+        deck = load_deck(deck_name)[first_card:last_card]
+    if not deck:
+        print("No cards to print, no PDFs written.")
+        return [], []
+
+    front = VolumeCanvas(front_output, pages_per_volume) if "front" in sides else None
+    back = VolumeCanvas(back_output, pages_per_volume) if "back" in sides else None
+
+    placed_cards = iter_layout(deck, first_card)
+    for n, (_, page_cards) in enumerate(groupby(placed_cards, key=itemgetter(0))):
+        page_cards = list(page_cards)
+        if front:
+            with PROFILER.stage("front_pages"):
+                if n:
+                    front.showPage()
+                draw_front_page(
+                    front,
+                    page_cards,
+                    background_images,
+                    keep_combined,
+                    vector,
+                    image_format,
+                )
+        if back:
+            with PROFILER.stage("back_pages"):
+                if n:
+                    back.showPage()
+                draw_back_page(back, page_cards, background_images, image_format)
+
+    front_paths = back_paths = []
+    with PROFILER.stage("save_pdfs"):
+        if front:
+            front.save()
+            front_paths = front.paths
+        if back:
+            back.save()
+            back_paths = back.paths
+    return front_paths, back_paths
+
+
+def create_qr_codes_pdf(
+    background_images=None,
+    keep_combined=False,
+    vector=False,
+    pages_per_volume=None,
+    output="pdf/qr_codes_front.pdf",
+    pages=None,
+):
+    """Create PDF with just QR codes, returning the paths written"""
+    front_paths, _ = build_duplex_deck(
+        background_images,
+        keep_combined=keep_combined,
+        vector=vector,
+        pages_per_volume=pages_per_volume,
+        front_output=output,
+        pages=pages,
+        sides=("front",),
+    )
+    return front_paths
+
+
+def create_metadata_pdf(
+    background_images=None,
+    pages_per_volume=None,
+    output="pdf/metadata_back.pdf",
+    pages=None,
+):
+    """Create PDF with metadata, returning the paths written"""
+    _, back_paths = build_duplex_deck(
+        background_images,
+        pages_per_volume=pages_per_volume,
+        back_output=output,
+        pages=pages,
+        sides=("back",),
+    )
+    return back_paths
+
+
+# Card font file, followed by the alternative file names tried in turn
+FONT_FILES = [
+    "font.ttf",
+    "fonts/BauhausBoldBT.ttf",
+    "fonts/BauhausBoldBT.otf",
+    "fonts/BauhausBoldBT.woff",
+    "fonts/bauhaus_bold_bt.ttf",
+    "fonts/bauhaus_bold_bt.otf",
+    "BauhausBoldBT.ttf",
+    "BauhausBoldBT.otf",
+]
+
+
+def register_fonts():
+    """Register the card font, trying the known alternative file names"""
+    for font_file in FONT_FILES:
+        if register_custom_font(font_file, "BauhausBoldBT"):
+            return True
+    return False
+
+
+def join_pdfs(paths, output):
+    """Concatenate PDFs into output, sharing identical objects like backgrounds"""
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for path in paths:
+        writer.append(path)
+    writer.compress_identical_objects()
+    with open(output, "wb") as f:
+        writer.write(f)
+    PROFILER.count("files_written")
+    PROFILER.count("pdf_bytes", os.path.getsize(output))
+
+
+def create_pdfs_parallel(
+    background_images,
+    workers,
+    pages_per_volume=None,
+    front_output="pdf/qr_codes_front.pdf",
+    back_output="pdf/metadata_back.pdf",
+    deck_name=None,
+    **options,
+):
+    """Render the deck in page ranges, one worker process per range
+
+    Every worker builds both sides of its range in one pass. With
+    pages_per_volume every range is one finished volume; otherwise the ranges
+    are joined into front_output and back_output. Returns the front and back
+    paths.
+    """
+    page_count = math.ceil(len(load_deck(deck_name)) / CARDS_PER_PAGE)
+    if not page_count:
+        # No shards to render or join, say so like the sequential path does
+        print("No cards to print, no PDFs written.")
+        return [], []
+    if pages_per_volume:
+        shard_pages = pages_per_volume
+    else:
+        # One range per worker
+        shard_pages = max(1, math.ceil(page_count / workers))
+    shards = [
+        range(first, min(first + shard_pages, page_count))
+        for first in range(0, page_count, shard_pages)
+    ]
+
+    outputs = {"front": front_output, "back": back_output}
+    shard_paths = {}
+    for side, output in outputs.items():
+        root, ext = os.path.splitext(output)
+        suffix = "_" if pages_per_volume else ".part"
+        shard_paths[side] = [
+            f"{root}{suffix}{n:03d}{ext}" for n in range(1, len(shards) + 1)
         ]
-        for alt_name in alternative_names:
-            if register_custom_font(alt_name, "BauhausBoldBT"):
-                custom_font_available = True
-                break
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=register_fonts) as ex:
+        futures = [
+            ex.submit(
+                build_duplex_deck,
+                background_images,
+                front_output=front_path,
+                back_output=back_path,
+                pages=pages,
+                deck_name=deck_name,
+                **options,
+            )
+            for front_path, back_path, pages in zip(
+                shard_paths["front"], shard_paths["back"], shards
+            )
+        ]
+        for future in futures:
+            future.result()
+
+    if pages_per_volume:
+        # Counts made in the workers are lost, count the volumes here
+        for path in shard_paths["front"] + shard_paths["back"]:
+            PROFILER.count("files_written")
+            PROFILER.count("pdf_bytes", os.path.getsize(path))
+        return shard_paths["front"], shard_paths["back"]
+
+    for side, output in outputs.items():
+        join_pdfs(shard_paths[side], output)
+        for path in shard_paths[side]:
+            os.remove(path)
+    return [outputs["front"]], [outputs["back"]]
+
+
+def output_paths(deck_name=None):
+    """Front and back PDF paths, in pdf/ or a deck's own pdf/<deck>/
+
+    The output directory is created if it does not exist yet.
+    """
+    output_dir = "pdf"
+    if deck_name is not None:
+        output_dir = os.path.join(
+            "pdf", os.path.splitext(os.path.basename(deck_path(deck_name)))[0]
+        )
+    os.makedirs(output_dir, exist_ok=True)
+    return (
+        os.path.join(output_dir, "qr_codes_front.pdf"),
+        os.path.join(output_dir, "metadata_back.pdf"),
+    )
+
+
+def find_background_images(background_folder="background"):
+    """Paths of the PNG backgrounds in background_folder, in cycling order"""
+    if not os.path.exists(background_folder):
+        return []
+    bg_files = sorted(
+        f for f in os.listdir(background_folder) if f.lower().endswith(".png")
+    )
+    return [os.path.join(background_folder, f) for f in bg_files]
+
+
+def main(
+    background_folder="background",
+    keep_combined=False,
+    vector=False,
+    pages_per_volume=None,
+    workers=1,
+    deck_name=None,
+    image_format="png",
+):
+    front_output, back_output = output_paths(deck_name)
+
+    with PROFILER.stage("register_fonts"):
+        register_fonts()
 
     # Load background images from folder
-    background_images = []
+    background_images = find_background_images(background_folder)
     if os.path.exists(background_folder):
-        # Get all PNG files from the background folder and sort them
-        bg_files = sorted(
-            [f for f in os.listdir(background_folder) if f.lower().endswith(".png")]
-        )
-        background_images = [os.path.join(background_folder, f) for f in bg_files]
+        bg_files = [os.path.basename(path) for path in background_images]
         print(f"Found {len(background_images)} background images: {bg_files}")
     else:
         print(
             f"Background folder '{background_folder}' not found, using default backgrounds"
         )
 
+    # Downsample the backgrounds up front, so worker processes find them cached
+    with PROFILER.stage("prepare_assets"):
+        for background_image in background_images:
+            prepare_background(background_image, image_format)
+
     # Generate both PDFs
-    create_qr_codes_pdf(background_images)
-    create_metadata_pdf(background_images)
+    if workers > 1:
+        # Worker processes are not profiled, only the time they take as a whole
+        with PROFILER.stage("render_parallel"):
+            front_paths, back_paths = create_pdfs_parallel(
+                background_images,
+                workers,
+                pages_per_volume=pages_per_volume,
+                front_output=front_output,
+                back_output=back_output,
+                deck_name=deck_name,
+                keep_combined=keep_combined,
+                vector=vector,
+                image_format=image_format,
+            )
+    else:
+        front_paths, back_paths = build_duplex_deck(
+            background_images,
+            keep_combined=keep_combined,
+            vector=vector,
+            pages_per_volume=pages_per_volume,
+            front_output=front_output,
+            back_output=back_output,
+            deck_name=deck_name,
+            image_format=image_format,
+        )
+    if not front_paths and not back_paths:
+        return
     print("PDFs generated successfully!")
-    print(" - QR codes: pdf/qr_codes_front.pdf")
-    print(" - Metadata: pdf/metadata_back.pdf")
+    print(f" - QR codes: {', '.join(front_paths)}")
+    print(f" - Metadata: {', '.join(back_paths)}")
     if background_images:
         print(
             f" - Background cycling: Every 10 songs switches between {len(background_images)} images"
         )
 
 
-if __name__ == "__main__":
+def cli(argv=None, prog=None):
+    """Command line entry point for printing the cards"""
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Create printable PDFs of the cards"
+    )
+    parser.add_argument(
+        "--keep-combined",
+        action="store_true",
+        help="also save each composited card as qr_codes/<file>_combined.png",
+    )
+    parser.add_argument(
+        "--vector",
+        action="store_true",
+        help="draw QR codes as vector shapes instead of black and white images",
+    )
+    parser.add_argument(
+        "--image-format",
+        choices=sorted(IMAGE_FORMATS),
+        default="png",
+        help="embed backgrounds losslessly (png) or as much smaller JPEGs "
+        "(default: png)",
+    )
+    parser.add_argument(
+        "--volume-pages",
+        type=int,
+        help="split the PDFs into numbered volumes of this many pages",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="render page ranges of both sides in this many processes",
+    )
+    parser.add_argument(
+        "--deck",
+        help="only print the cards of this playlist's deck, into pdf/<deck>/",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile:
+        PROFILER.start(
+            cprofile=args.profile_functions, trace_memory=args.profile_memory
+        )
     # Use background folder for cycling backgrounds
-    main("background")
+    main(
+        "background",
+        keep_combined=args.keep_combined,
+        vector=args.vector,
+        pages_per_volume=args.volume_pages,
+        workers=args.workers,
+        deck_name=args.deck,
+        image_format=args.image_format,
+    )
+    if args.profile:
+        PROFILER.write(args.profile)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,134 @@
+import argparse
+from functools import lru_cache
+
+from metadata_store import (
+    METADATA_STORE_PATH,
+    read_metadata_store,
+    write_metadata_store,
+)
+
+# Bump whenever the cleaning or wrapping rules below change, so stored label
+# layouts are recomputed
+LABEL_LAYOUT_VERSION = 1
+# Characters per line and lines per label for title and artist
+LABEL_LINE_CHARS = 15
+LABEL_MAX_LINES = 3
+
+
+def wrap_text_by_char_limit(text, max_line_chars=10, max_lines=3):
+    """Wrap text by character count per line, breaking at spaces.
+    Returns up to max_lines lines; does not exceed max_line_chars per line.
+    """
+    if not text:
+        return [""]
+    words = text.split()
+    if not words:
+        return [""]
+    lines = []
+    current_line = ""
+    for word in words:
+        candidate = current_line + (" " if current_line else "") + word
+        if len(candidate) <= max_line_chars:
+            current_line = candidate
+        else:
+            if current_line:
+                lines.append(current_line)
+                if len(lines) == max_lines:
+                    break
+                current_line = (
+                    word if len(word) <= max_line_chars else word[:max_line_chars]
+                )
+            else:
+                # Single word longer than max_line_chars: hard-cut
+                lines.append(word[:max_line_chars])
+                if len(lines) == max_lines:
+                    current_line = ""
+                    break
+                current_line = ""
+    if current_line and len(lines) < max_lines:
+        lines.append(current_line)
+    return lines
+
+
+def remove_metainfo_text(title_text):
+    # Enforce hard title length limit
+    title_text = title_text.split("-")[0].strip()
+    temp = title_text.split(".")
+    if len(temp) <= 2:
+        title_text = temp[0].strip()
+    title_text = title_text.split(",")[0].strip()
+    title_text = title_text.split("(")
+    if len(title_text) > 1:
+        if len(title_text[0]) > 5:
+            title_text = title_text[0]
+        else:
+            title_text = title_text[1]
+    else:
+        title_text = title_text[0]
+    return title_text
+
+
+@lru_cache(maxsize=65536)
+def label_lines(text):
+    """Clean up a title or artist name and wrap it into label lines"""
+    return tuple(
+        wrap_text_by_char_limit(
+            remove_metainfo_text(text),
+            max_line_chars=LABEL_LINE_CHARS,
+            max_lines=LABEL_MAX_LINES,
+        )
+    )
+
+
+def label_layout(record):
+    """Compute the stored label fields of a metadata record"""
+    return {
+        "layout_version": LABEL_LAYOUT_VERSION,
+        "title_lines": list(label_lines(record.get("name", "Unknown"))),
+        "artist_lines": list(label_lines(record.get("artists", ["Unknown Artist"])[0])),
+    }
+
+
+def ensure_label_layout(record):
+    """Return record with an up to date label layout, computing it only if needed"""
+    if record.get("layout_version") == LABEL_LAYOUT_VERSION:
+        return record
+    return {**record, **label_layout(record)}
+
+
+def relayout_metadata_store(path=METADATA_STORE_PATH, force=False):
+    """Recompute the label layout of every outdated record in the store
+
+    Titles and artists shared by many tracks are only laid out once. With
+    force set every record is laid out again. Returns the number of records
+    updated.
+    """
+    records = list(read_metadata_store(path).values())
+    updated = 0
+    for i, record in enumerate(records):
+        if force or record.get("layout_version") != LABEL_LAYOUT_VERSION:
+            records[i] = {**record, **label_layout(record)}
+            updated += 1
+    if updated:
+        write_metadata_store(records, path)
+    return updated
+
+
+def cli(argv=None, prog=None):
+    """Command line entry point for re-laying out the metadata store"""
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Recompute the card label layout stored with the track metadata",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="lay out every record again, not just outdated ones",
+    )
+    args = parser.parse_args(argv)
+    updated = relayout_metadata_store(force=args.force)
+    print(f"Updated the label layout of {updated} tracks.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,91 @@
+import json
+import os
+
+from profiling import PROFILER
+
+# Single file holding the metadata of every track, one JSON object per line
+METADATA_STORE_PATH = "qr_codes/metadata.jsonl"
+
+
+def write_metadata_store(records, path=METADATA_STORE_PATH):
+    """Write all track metadata records to the store in one go"""
+    # Write to a temporary file first so readers never see a partial store
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+    os.replace(tmp_path, path)
+    PROFILER.count("files_written")
+
+
+def read_metadata_store(path=METADATA_STORE_PATH):
+    """Read the store in one sequential pass, returning records keyed by track id"""
+    records = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record["id"]] = record
+    return records
+
+
+# Per-playlist card lists, each referring to records of the shared store
+DECKS_DIR = "decks"
+
+
+def deck_path(deck_name, decks_dir=DECKS_DIR):
+    """Path of the deck file for a playlist name"""
+    safe_name = "".join(x for x in deck_name if x.isalnum() or x in (" ", "-", "_"))
+    return os.path.join(decks_dir, f"{safe_name}.json")
+
+
+def write_deck(deck_name, track_ids, decks_dir=DECKS_DIR, **info):
+    """Write the ids of the tracks making up a deck, plus any extra info"""
+    os.makedirs(decks_dir, exist_ok=True)
+    path = deck_path(deck_name, decks_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {"name": deck_name, **info, "track_ids": list(track_ids)},
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+    os.replace(tmp_path, path)
+    PROFILER.count("files_written")
+    return path
+
+
+def read_deck(deck_name, decks_dir=DECKS_DIR):
+    """Read the track ids of a deck written by write_deck"""
+    with open(deck_path(deck_name, decks_dir), "r", encoding="utf-8") as f:
+        return json.load(f)["track_ids"]
+
+
+def referenced_track_ids(decks_dir=DECKS_DIR):
+    """Ids of all tracks listed by any deck file"""
+    track_ids = set()
+    if not os.path.isdir(decks_dir):
+        return track_ids
+    for entry in os.scandir(decks_dir):
+        if entry.name.endswith(".json"):
+            with open(entry.path, "r", encoding="utf-8") as f:
+                track_ids.update(json.load(f)["track_ids"])
+    return track_ids
+
+
+def merge_metadata_store(records, path=METADATA_STORE_PATH, decks_dir=DECKS_DIR):
+    """Add or replace records in the store, dropping tracks no deck lists
+
+    Tracks of decks that were not part of this run keep their records. Write
+    the deck files first. Returns the records kept, keyed by track id.
+    """
+    merged = read_metadata_store(path) if os.path.exists(path) else {}
+    merged.update((record["id"], record) for record in records)
+    in_use = referenced_track_ids(decks_dir)
+    kept = {
+        track_id: record for track_id, record in merged.items() if track_id in in_use
+    }
+    write_metadata_store(kept.values(), path)
+    return kept
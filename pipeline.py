@@ -0,0 +1,406 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from label_layout import LABEL_LAYOUT_VERSION
+from metadata_store import METADATA_STORE_PATH, read_metadata_store
+from profiling import PROFILER, add_profile_arguments
+
+# Stages in the order they run
+STAGES = ["fetch", "normalize", "encode_qr", "composite", "render_front", "render_back"]
+# Hashes of every stage's inputs and outputs from its last successful run
+PIPELINE_STATE_PATH = "cache/pipeline_state.json"
+# Playlist names with their ids and cached listings, written by the fetch stage
+PIPELINE_PLAYLISTS_PATH = "cache/pipeline_playlists.json"
+
+
+class StageFailed(Exception):
+    """Raised by a stage that cannot produce its outputs"""
+
+
+def hash_value(value):
+    """Hash a JSON-serialisable value"""
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def hash_files(paths):
+    """Hash the names and contents of files; a missing file changes the hash"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        file_digest = hashlib.sha256()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    file_digest.update(chunk)
+            content = file_digest.hexdigest()
+        else:
+            content = "missing"
+        digest.update(f"{path}\0{content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_state(path=PIPELINE_STATE_PATH):
+    """Load the pipeline state, or an empty one if there is none yet"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable pipeline state {path}: {e}")
+        return {}
+
+
+def save_state(state, path=PIPELINE_STATE_PATH):
+    """Atomically write the pipeline state"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_stage(state, name, inputs, run, force=False):
+    """Run one stage unless nothing it depends on changed since it last succeeded
+
+    inputs describes everything the stage reads, including the output hashes
+    of the stages before it. run() does the work and returns the paths of the
+    files it wrote. The state is saved after every stage, so an interrupted
+    pipeline resumes at the stage that did not finish. Returns the hash of
+    the stage's outputs.
+    """
+    inputs_hash = hash_value(inputs)
+    previous = state.get(name)
+    if (
+        not force
+        and previous is not None
+        and previous["inputs"] == inputs_hash
+        and hash_files(previous["files"]) == previous["outputs"]
+    ):
+        print(f"[{name}] up to date, skipped")
+        return previous["outputs"]
+
+    print(f"[{name}] running")
+    with PROFILER.stage(name):
+        files = run()
+    outputs_hash = hash_files(files)
+    state[name] = {
+        "inputs": inputs_hash,
+        "outputs": outputs_hash,
+        "files": sorted(files),
+    }
+    save_state(state)
+    return outputs_hash
+
+
+def fetch(users, playlist_names, use_async=False):
+    """Find the playlists and bring their cached track listings up to date
+
+    Only a playlist whose snapshot_id changed is fetched again, so this costs
+    one request per playlist when nothing changed on Spotify.
+    """
+    import spotify_qr_downloader as downloader
+
+    sp = downloader.setup_spotify()
+    try:
+        playlist_ids = downloader.find_user_playlists(sp, users, playlist_names)
+    except ValueError as e:
+        raise StageFailed(str(e)) from e
+    missing = [name for name in playlist_names or () if name not in playlist_ids]
+    if missing:
+        raise StageFailed(f"Playlists not found: {', '.join(missing)}")
+    if not playlist_ids:
+        raise StageFailed("No playlists found")
+
+    downloader.fetch_playlists(sp, playlist_ids, use_async=use_async)
+    playlists = {
+        name: {
+            "id": playlist_id,
+            "listing": os.path.join(
+                downloader.PLAYLIST_CACHE_DIR, f"{playlist_id}.json"
+            ),
+        }
+        for name, playlist_id in playlist_ids.items()
+    }
+    tmp_path = f"{PIPELINE_PLAYLISTS_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(playlists, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, PIPELINE_PLAYLISTS_PATH)
+    return [PIPELINE_PLAYLISTS_PATH] + [p["listing"] for p in playlists.values()]
+
+
+def normalize(qr_mode="url"):
+    """Turn the cached listings into the metadata store and deck files"""
+    import spotify_qr_downloader as downloader
+    from metadata_store import merge_metadata_store, write_deck
+
+    with open(PIPELINE_PLAYLISTS_PATH, "r", encoding="utf-8") as f:
+        playlists = json.load(f)
+    listings = {}
+    for name, playlist in playlists.items():
+        with open(playlist["listing"], "r", encoding="utf-8") as f:
+            listings[name] = json.load(f)["tracks"]
+
+    tracks, decks, shared = downloader.collect_tracks(listings)
+    records = [
+        downloader.build_track_metadata(track, track_id, base_filename, qr_mode)
+        for track_id, (track, base_filename) in tracks.items()
+    ]
+
+    os.makedirs("qr_codes", exist_ok=True)
+    deck_files = [
+        write_deck(name, deck, playlist_id=playlists[name]["id"])
+        for name, deck in decks.items()
+    ]
+    # Decks from other runs keep their tracks
+    merge_metadata_store(records)
+    print(f"{len(records)} tracks, {shared} shared between playlists")
+    return [METADATA_STORE_PATH] + deck_files
+
+
+def encode_qr(workers=1):
+    """Write the QR code PNG of every track in the metadata store"""
+    from qr_cache import evict_qr_cache
+    from spotify_qr_downloader import count_qr_png, create_qr_png
+
+    records = read_metadata_store().values()
+    payloads = [record["qr_payload"] for record in records]
+    paths = [os.path.join("qr_codes", record["qr_file"]) for record in records]
+    modes = [record["qr_mode"] for record in records]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(create_qr_png, payloads, paths, modes))
+    else:
+        rendered = [create_qr_png(*job) for job in zip(payloads, paths, modes)]
+    for was_rendered in rendered:
+        count_qr_png(was_rendered)
+    evict_qr_cache()
+    return paths
+
+
+def composite(background_images, image_format="png"):
+    """Downsample the backgrounds to the card size at print resolution"""
+    from create_qr_pdf import prepare_background
+
+    return [prepare_background(path, image_format) for path in background_images]
+
+
+def render(side, background_images, deck_name=None, **options):
+    """Render one side of the cards, returning the PDF paths written"""
+    import create_qr_pdf
+
+    front_output, back_output = create_qr_pdf.output_paths(deck_name)
+    if side == "back":
+        create_qr_pdf.register_fonts()
+    front_paths, back_paths = create_qr_pdf.build_duplex_deck(
+        background_images,
+        front_output=front_output,
+        back_output=back_output,
+        sides=(side,),
+        deck_name=deck_name,
+        **options,
+    )
+    return front_paths if side == "front" else back_paths
+
+
+def main(
+    users=("goupher",),
+    playlist_names=("Schlickenriester 2",),
+    qr_mode="url",
+    use_async=False,
+    workers=1,
+    vector=False,
+    image_format="png",
+    pages_per_volume=None,
+    deck_name=None,
+    force=(),
+):
+    """Run every stage from fetching the playlists to both PDFs
+
+    A stage is skipped when its inputs, including the outputs of the stages
+    it depends on, are unchanged since it last succeeded. Stages named in
+    force run regardless. Only Spotify knows whether a playlist changed, so
+    fetch always runs; its outputs are the listing files, which stay the same
+    while the playlists do, and the later stages are skipped then.
+    """
+    from create_qr_pdf import FONT_FILES, find_background_images
+
+    state = load_state()
+    background_images = find_background_images()
+
+    fetched = run_stage(
+        state,
+        "fetch",
+        {
+            "users": sorted(users),
+            "playlists": None if playlist_names is None else sorted(playlist_names),
+        },
+        lambda: fetch(users, playlist_names, use_async),
+        force=True,
+    )
+    deck = run_stage(
+        state,
+        "normalize",
+        {
+            "fetch": fetched,
+            "qr_mode": qr_mode,
+            "label_layout_version": LABEL_LAYOUT_VERSION,
+        },
+        lambda: normalize(qr_mode),
+        force="normalize" in force,
+    )
+    codes = run_stage(
+        state,
+        "encode_qr",
+        {"normalize": deck},
+        lambda: encode_qr(workers),
+        force="encode_qr" in force,
+    )
+    assets = run_stage(
+        state,
+        "composite",
+        {"backgrounds": hash_files(background_images), "image_format": image_format},
+        lambda: composite(background_images, image_format),
+        force="composite" in force,
+    )
+    # The front reads its QR codes from the PNGs encode_qr put in the QR
+    # cache; only the back depends on the font
+    render_options = {
+        "image_format": image_format,
+        "pages_per_volume": pages_per_volume,
+        "deck_name": deck_name,
+    }
+    run_stage(
+        state,
+        "render_front",
+        {
+            "normalize": deck,
+            "encode_qr": codes,
+            "composite": assets,
+            "vector": vector,
+            **render_options,
+        },
+        lambda: render("front", background_images, vector=vector, **render_options),
+        force="render_front" in force,
+    )
+    run_stage(
+        state,
+        "render_back",
+        {
+            "normalize": deck,
+            "composite": assets,
+            "font": hash_files(f for f in FONT_FILES if os.path.exists(f)),
+            **render_options,
+        },
+        lambda: render("back", background_images, **render_options),
+        force="render_back" in force,
+    )
+    print("\nPipeline finished.")
+
+
+def cli(argv=None, prog=None):
+    """Command line entry point for running the whole pipeline"""
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Fetch playlists and create the card PDFs, "
+        "skipping every stage whose inputs did not change",
+    )
+    parser.add_argument(
+        "--user",
+        dest="users",
+        action="append",
+        help="Spotify user whose playlists to use, may be repeated (default: goupher)",
+    )
+    parser.add_argument(
+        "--playlist",
+        dest="playlists",
+        action="append",
+        help="playlist name to turn into a deck, may be repeated "
+        "(default: Schlickenriester 2)",
+    )
+    parser.add_argument(
+        "--all-playlists",
+        action="store_true",
+        help="turn every playlist of the users into a deck",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="encode spotify: URIs at a fixed QR version instead of web links",
+    )
+    parser.add_argument(
+        "--async-fetch",
+        action="store_true",
+        help="fetch playlist pages with the asyncio client",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes generating QR codes (default: 1)",
+    )
+    parser.add_argument(
+        "--vector",
+        action="store_true",
+        help="draw QR codes as vector shapes instead of black and white images",
+    )
+    parser.add_argument(
+        "--image-format",
+        choices=["jpeg", "png"],
+        default="png",
+        help="embed backgrounds losslessly (png) or as much smaller JPEGs "
+        "(default: png)",
+    )
+    parser.add_argument(
+        "--volume-pages",
+        type=int,
+        help="split the PDFs into numbered volumes of this many pages",
+    )
+    parser.add_argument(
+        "--deck",
+        help="only print the cards of this playlist's deck, into pdf/<deck>/",
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        # fetch always runs
+        choices=STAGES[1:],
+        default=[],
+        help="run this stage even if its inputs are unchanged, may be repeated",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile:
+        PROFILER.start(
+            cprofile=args.profile_functions, trace_memory=args.profile_memory
+        )
+    if args.all_playlists:
+        playlist_names = None
+    else:
+        playlist_names = args.playlists or ["Schlickenriester 2"]
+    try:
+        main(
+            users=args.users or ["goupher"],
+            playlist_names=playlist_names,
+            qr_mode="compact" if args.compact else "url",
+            use_async=args.async_fetch,
+            workers=args.workers,
+            vector=args.vector,
+            image_format=args.image_format,
+            pages_per_volume=args.volume_pages,
+            deck_name=args.deck,
+            force=args.force,
+        )
+    except StageFailed as e:
+        print(f"\n{e}. Fix the problem and rerun to resume from this stage.")
+        return 1
+    finally:
+        if args.profile:
+            PROFILER.write(args.profile)
+
+
+if __name__ == "__main__":
+    raise SystemExit(cli())
@@ -0,0 +1,135 @@
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Profiler:
+    """Records wall/CPU time per stage and event counters for --profile runs
+
+    Until start() is called every method is a cheap no-op, so the scripts can
+    call stage() and count() unconditionally. Work done in worker processes is
+    not counted.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = Counter()
+        self._cprofile = None
+        self._tracemalloc = False
+
+    def start(self, cprofile=False, trace_memory=False):
+        """Enable recording, optionally with cProfile and tracemalloc"""
+        self.enabled = True
+        self._started = (time.perf_counter(), time.process_time())
+        if cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        if trace_memory:
+            self._tracemalloc = True
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block as part of the named stage
+
+        A stage entered several times (e.g. once per page) adds up.
+        """
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            totals = self.stages.setdefault(name, {"wall_s": 0, "cpu_s": 0, "calls": 0})
+            totals["wall_s"] += time.perf_counter() - wall
+            totals["cpu_s"] += time.process_time() - cpu
+            totals["calls"] += 1
+
+    def count(self, name, amount=1):
+        """Add amount to the named counter"""
+        if self.enabled:
+            self.counters[name] += amount
+
+    def report(self, top=25):
+        """Collect everything recorded so far into a JSON-serialisable dict"""
+        wall, cpu = self._started
+        report = {
+            "total": {
+                "wall_s": round(time.perf_counter() - wall, 4),
+                "cpu_s": round(time.process_time() - cpu, 4),
+            },
+            "stages": {
+                name: {
+                    "wall_s": round(totals["wall_s"], 4),
+                    "cpu_s": round(totals["cpu_s"], 4),
+                    "calls": totals["calls"],
+                }
+                for name, totals in self.stages.items()
+            },
+            "counters": dict(self.counters),
+        }
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            stats = pstats.Stats(self._cprofile).stats
+            hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+            report["functions"] = [
+                {
+                    "function": f"{filename}:{line}({function})",
+                    "calls": calls,
+                    "own_s": round(own, 4),
+                    "cumulative_s": round(cumulative, 4),
+                }
+                for (filename, line, function), (_, calls, own, cumulative, _) in (
+                    hottest[:top]
+                )
+            ]
+        if self._tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            report["memory"] = {
+                "peak_traced_kb": round(peak / 1024, 1),
+                "allocations": [
+                    {
+                        "location": str(stat.traceback),
+                        "size_kb": round(stat.size / 1024, 1),
+                        "count": stat.count,
+                    }
+                    for stat in snapshot.statistics("lineno")[:top]
+                ],
+            }
+        return report
+
+    def write(self, path):
+        """Write the report as JSON to path"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Profile written to {path}")
+
+
+# Shared by all modules of a run
+PROFILER = Profiler()
+
+
+def add_profile_arguments(parser):
+    """Add the --profile options to a script's argument parser"""
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="write stage timings and counters as JSON to FILE",
+    )
+    parser.add_argument(
+        "--profile-functions",
+        action="store_true",
+        help="with --profile, also record the hottest functions using cProfile",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="with --profile, also record the largest allocations using tracemalloc",
+    )
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import shutil
+
+# Shared store of rendered QR codes, named by what they encode
+QR_CACHE_DIR = "cache/qr"
+# Least recently used entries are evicted once the cache grows past this size
+QR_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def qr_cache_key(payload, settings):
+    """Hash of everything a rendered QR code depends on"""
+    encoded = json.dumps({"payload": payload, "settings": settings}, sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def qr_cache_path(payload, settings, cache_dir=QR_CACHE_DIR):
+    """Path the PNG for payload and settings is cached at, if it is cached"""
+    return os.path.join(cache_dir, f"{qr_cache_key(payload, settings)}.png")
+
+
+def cached_qr_png(payload, settings, render, cache_dir=QR_CACHE_DIR):
+    """Return the cached PNG for payload and settings, rendering it on a miss
+
+    render(path) must write the PNG to path. Entries are written atomically,
+    so processes sharing the cache never see a partial file. Returns (path,
+    rendered), rendered telling whether this call had to render the code;
+    callers count hits and misses, since counters in worker processes are lost.
+    """
+    path = qr_cache_path(payload, settings, cache_dir)
+    if os.path.exists(path):
+        # The modification time doubles as the last use for LRU eviction
+        os.utime(path)
+        return path, False
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path[:-4]}.{os.getpid()}.tmp.png"
+    render(tmp_path)
+    os.replace(tmp_path, path)
+    return path, True
+
+
+def link_or_copy(source, destination):
+    """Place a cached file at destination, hard linking it when possible"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        # Different file system, or links not supported
+        shutil.copyfile(source, destination)
+
+
+def evict_qr_cache(max_bytes=QR_CACHE_MAX_BYTES, cache_dir=QR_CACHE_DIR):
+    """Delete least recently used entries until the cache fits in max_bytes
+
+    Returns the number of entries removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = [
+        entry
+        for entry in os.scandir(cache_dir)
+        if entry.is_file() and not entry.name.endswith(".tmp.png")
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    removed = 0
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+        removed += 1
+    return removed
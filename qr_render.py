@@ -0,0 +1,87 @@
+from profiling import PROFILER
+
+# numpy, PIL and qrcode are imported where they are used, so the downloader
+# and the command line tool start without loading them. The error correction
+# levels are the values of qrcode.constants for the same reason.
+ERROR_CORRECT_L = 1
+ERROR_CORRECT_M = 0
+
+QR_SETTINGS = {
+    "version": 1,
+    "error_correction": ERROR_CORRECT_L,
+    "box_size": 10,
+    "border": 4,
+}
+# A spotify: URI of a track fits version 3 (29 modules) at error correction M.
+# Fixing the version and mask skips the fit and mask searches.
+COMPACT_QR_SETTINGS = {
+    "version": 3,
+    "error_correction": ERROR_CORRECT_M,
+    "box_size": 10,
+    "border": 4,
+    "mask_pattern": 0,
+}
+# "url" encodes the open.spotify.com link, "compact" the spotify: URI
+QR_MODES = {"url": QR_SETTINGS, "compact": COMPACT_QR_SETTINGS}
+
+
+def qr_payload(spotify_url, mode="url"):
+    """Text to encode for a Spotify link in the given mode"""
+    if mode == "url":
+        return spotify_url
+    # https://open.spotify.com/track/<id>?si=... -> spotify:track:<id>
+    kind, item_id = spotify_url.split("?")[0].rstrip("/").split("/")[-2:]
+    return f"spotify:{kind}:{item_id}"
+
+
+def make_qr(payload, mode="url"):
+    """Build the QR code for payload with the settings of mode"""
+    import qrcode
+
+    qr = qrcode.QRCode(**QR_MODES[mode])
+    qr.add_data(payload)
+    # Only the url mode has to search for a version that fits
+    qr.make(fit=mode == "url")
+    return qr
+
+
+def qr_matrix(payload, mode="url"):
+    """Encode payload and return its module matrix (True = dark), border included"""
+    import numpy as np
+
+    qr = make_qr(payload, mode)
+    PROFILER.count("qr_encodes")
+    return np.array(qr.get_matrix(), dtype=bool)
+
+
+def matrix_from_png(path, box_size=QR_SETTINGS["box_size"]):
+    """Recover the module matrix from a QR code PNG by sampling module centres"""
+    import numpy as np
+    import PIL.Image
+
+    pixels = np.array(PIL.Image.open(path).convert("L"))
+    PROFILER.count("images_decoded")
+    return pixels[box_size // 2 :: box_size, box_size // 2 :: box_size] < 128
+
+
+def scale_matrix(matrix, size):
+    """Scale a module matrix to a size x size pixel mask"""
+    import numpy as np
+
+    # Map every output pixel to the module it falls in, so sizes that are not
+    # a multiple of the module count still come out exact
+    index = np.arange(size) * matrix.shape[0] // size
+    return matrix[np.ix_(index, index)]
+
+
+def matrix_runs(matrix):
+    """Return (row, start, length) for every horizontal run of dark modules"""
+    import numpy as np
+
+    padded = np.zeros((matrix.shape[0], matrix.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    # nonzero() walks row by row, so run starts and ends pair up in order
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return list(zip(rows.tolist(), starts.tolist(), (ends - starts).tolist()))
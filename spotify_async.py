@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+from profiling import PROFILER
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+# Maximum page size the playlist tracks endpoint accepts
+PAGE_SIZE = 100
+# Requests in flight at once; Spotify throttles with 429 well before this hurts
+MAX_CONCURRENCY = 16
+# How often a single request is retried after a 429 before giving up
+MAX_RETRIES = 5
+# Wait used when a 429 response carries no Retry-After header
+DEFAULT_RETRY_AFTER = 1
+
+
+class SpotifyRateLimited(Exception):
+    """Raised when a request is still throttled after MAX_RETRIES attempts"""
+
+
+def retry_after_seconds(value):
+    """Seconds to wait for a Retry-After header value
+
+    The header holds either a number of seconds or an HTTP date. A missing
+    or unparseable value falls back to DEFAULT_RETRY_AFTER.
+    """
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        resume_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    if resume_at.tzinfo is None:
+        resume_at = resume_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (resume_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AsyncSpotify:
+    """Minimal asyncio Spotify Web API client
+
+    All requests share one keep-alive connection pool and at most
+    max_concurrency of them are in flight. A 429 response pauses every request
+    of the client for the Retry-After period and the request is retried, so
+    bursts are throttled instead of failing. Point base_url at a local fake
+    server for testing. Use as an async context manager.
+    """
+
+    def __init__(
+        self,
+        access_token=None,
+        base_url=SPOTIFY_API_URL,
+        max_concurrency=MAX_CONCURRENCY,
+        max_retries=MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.access_token = access_token
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._session = None
+        self._semaphore = None
+        self._resume_at = 0
+
+    async def __aenter__(self):
+        headers = {}
+        if self.access_token:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self._session = aiohttp.ClientSession(headers=headers, connector=connector)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    async def _wait_for_rate_limit(self):
+        loop = asyncio.get_running_loop()
+        while (delay := self._resume_at - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def get(self, path, **params):
+        """GET an API path (e.g. "/playlists/<id>") and return the decoded JSON"""
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        for _ in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self._wait_for_rate_limit()
+                async with self._session.get(url, params=params or None) as response:
+                    body = await response.read()
+                    PROFILER.count("api_calls")
+                    PROFILER.count("bytes_fetched", len(body))
+                    if response.status != 429:
+                        response.raise_for_status()
+                        return await response.json()
+                    retry_after = retry_after_seconds(
+                        response.headers.get("Retry-After")
+                    )
+            # Pause every request of this client, not just this one
+            loop = asyncio.get_running_loop()
+            self._resume_at = max(self._resume_at, loop.time() + retry_after)
+            PROFILER.count("rate_limited")
+        raise SpotifyRateLimited(
+            f"Still rate limited after {self.max_retries} retries: {url}"
+        )
+
+    async def playlist(self, playlist_id, fields=None):
+        """Get a playlist object, optionally restricted to some fields"""
+        params = {"fields": fields} if fields else {}
+        return await self.get(f"/playlists/{playlist_id}", **params)
+
+    async def playlist_tracks(self, playlist_id):
+        """Get all track items of a playlist, in playlist order
+
+        The first page gives the total; all remaining pages are then requested
+        at once.
+        """
+        path = f"/playlists/{playlist_id}/tracks"
+        first = await self.get(path, limit=PAGE_SIZE)
+        offsets = range(len(first["items"]), first["total"], PAGE_SIZE)
+        # gather() returns results in argument order, so pages stay in order
+        pages = await asyncio.gather(
+            *(self.get(path, limit=PAGE_SIZE, offset=offset) for offset in offsets)
+        )
+        tracks = first["items"]
+        for page in pages:
+            tracks.extend(page["items"])
+        return tracks
+
+
+def spotify_access_token():
+    """Get an access token using the client credentials spotipy is set up with"""
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    return SpotifyClientCredentials().get_access_token(as_dict=False)
+
+
+def fetch_playlists_tracks(playlist_ids, access_token=None, base_url=SPOTIFY_API_URL):
+    """Fetch all tracks of several playlists from sync code, in argument order
+
+    Every playlist is fetched by the same client in one event loop, so they
+    share one session, one concurrency limit and one rate limit backoff.
+    """
+
+    async def fetch():
+        async with AsyncSpotify(access_token, base_url) as client:
+            return await asyncio.gather(
+                *(client.playlist_tracks(playlist_id) for playlist_id in playlist_ids)
+            )
+
+    return asyncio.run(fetch())
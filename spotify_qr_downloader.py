@@ -1,8 +1,17 @@
 import os
+import argparse
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
-import qrcode
 import json
+import hashlib
+import time
+from label_layout import label_layout
+from metadata_store import merge_metadata_store, referenced_track_ids, write_deck
+from qr_cache import cached_qr_png, evict_qr_cache, link_or_copy
+from qr_render import QR_MODES, make_qr, qr_payload
+from profiling import PROFILER, add_profile_arguments
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from urllib.parse import urlencode
 
 # Set up environment variables for Spotify authentication
@@ -10,51 +19,478 @@ os.environ["SPOTIPY_CLIENT_ID"] = ""
 os.environ["SPOTIPY_CLIENT_SECRET"] = ""
 os.environ["SPOTIPY_REDIRECT_URI"] = "http://127.0.0.1:8000/callback"
 
+# Maximum page size the playlist tracks endpoint accepts
+PAGE_SIZE = 100
+# Number of pages fetched at once in parallel pagination mode
+FETCH_WORKERS = 8
+# Number of playlists fetched at once in batch mode
+PLAYLIST_WORKERS = 4
+# Directory holding cached playlist track listings
+PLAYLIST_CACHE_DIR = "cache/playlists"
+# Directory holding the per-user playlist name to id indexes
+PLAYLIST_INDEX_DIR = "cache"
+# Seconds after which a playlist index is rebuilt from scratch
+PLAYLIST_INDEX_TTL = 24 * 60 * 60
+# Manifest recording which inputs each track's files were generated from
+MANIFEST_PATH = "qr_codes/manifest.json"
+
+
+def count_response(response, *args, **kwargs):
+    """requests hook counting API calls and bytes fetched for --profile"""
+    PROFILER.count("api_calls")
+    PROFILER.count("bytes_fetched", len(response.content))
+
 
 def setup_spotify():
-    """Setup Spotify client with proper authentication"""
+    """Setup Spotify client with proper authentication
+
+    spotipy's own session is kept for its retries on 429 and 5xx responses;
+    only its connection pool is widened to the number of concurrent fetches.
+    """
     auth_manager = SpotifyClientCredentials()
-    return spotipy.Spotify(auth_manager=auth_manager)
+    sp = spotipy.Spotify(auth_manager=auth_manager)
+    retry = sp._session.get_adapter(sp.prefix).max_retries
+    adapter = requests.adapters.HTTPAdapter(
+        max_retries=retry, pool_maxsize=PLAYLIST_WORKERS * FETCH_WORKERS
+    )
+    sp._session.mount("http://", adapter)
+    sp._session.mount("https://", adapter)
+    sp._session.hooks["response"].append(count_response)
+    return sp
+
 
+def get_playlist_tracks(sp, playlist_id, max_workers=None):
+    """Get all tracks from a playlist
 
-def get_playlist_tracks(sp, playlist_id):
-    """Get all tracks from a playlist"""
-    results = sp.playlist_tracks(playlist_id)
+    With max_workers set, the total is read from the first page and the
+    remaining offsets are fetched concurrently, then returned in playlist order.
+    """
+    results = sp.playlist_tracks(playlist_id, limit=PAGE_SIZE)
     tracks = results["items"]
+
+    if max_workers:
+        offsets = range(len(tracks), results["total"], PAGE_SIZE)
+
+        def fetch_page(offset):
+            return sp.playlist_tracks(playlist_id, limit=PAGE_SIZE, offset=offset)
+
+        # map() yields results in submission order, so pages stay in order
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for page in executor.map(fetch_page, offsets):
+                tracks.extend(page["items"])
+        return tracks
+
     while results["next"]:
         results = sp.next(results)
         tracks.extend(results["items"])
     return tracks
 
 
-def create_track_files(track, base_filename):
-    """Create QR code and metadata JSON for a track"""
-    # Create QR code
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(track["external_urls"]["spotify"])
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img.save(f"{base_filename}.png")
+def playlist_snapshot_id(sp, playlist_id):
+    """Request only the snapshot_id of a playlist, which changes with its tracks"""
+    return sp.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+
+
+def read_cached_tracks(playlist_id, snapshot_id, cache_dir=PLAYLIST_CACHE_DIR):
+    """Return the cached listing of a playlist if it is still at snapshot_id"""
+    cache_path = os.path.join(cache_dir, f"{playlist_id}.json")
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("snapshot_id") == snapshot_id:
+            print(f"Playlist unchanged (snapshot {snapshot_id}), using cache")
+            return cached["tracks"]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable playlist cache {cache_path}: {e}")
+    return None
+
+
+def write_cached_tracks(playlist_id, snapshot_id, tracks, cache_dir=PLAYLIST_CACHE_DIR):
+    """Store the listing of a playlist together with its snapshot_id"""
+    cache_path = os.path.join(cache_dir, f"{playlist_id}.json")
+    # Write to a temporary file first so an interrupted run never leaves
+    # a truncated cache behind
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"snapshot_id": snapshot_id, "tracks": tracks}, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    PROFILER.count("files_written")
+
+
+def get_playlist_tracks_cached(
+    sp, playlist_id, cache_dir=PLAYLIST_CACHE_DIR, max_workers=None
+):
+    """Get all tracks from a playlist, reusing the on-disk listing if unchanged
+
+    Only the playlist snapshot_id is requested up front; the full listing is
+    fetched again only when Spotify reports a different snapshot.
+    """
+    snapshot_id = playlist_snapshot_id(sp, playlist_id)
+    tracks = read_cached_tracks(playlist_id, snapshot_id, cache_dir)
+    if tracks is None:
+        tracks = get_playlist_tracks(sp, playlist_id, max_workers=max_workers)
+        write_cached_tracks(playlist_id, snapshot_id, tracks, cache_dir)
+    return tracks
+
+
+def create_qr_png(payload, path, qr_mode="url"):
+    """Write the QR code PNG of payload to path, reusing the cached image
+
+    Returns True if the code had to be encoded, False on a cache hit.
+    """
+
+    def render(render_path):
+        qr = make_qr(payload, qr_mode)
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(render_path)
+
+    cached_path, rendered = cached_qr_png(payload, QR_MODES[qr_mode], render)
+    link_or_copy(cached_path, path)
+    return rendered
+
+
+def count_qr_png(rendered):
+    """Count a QR code PNG written by create_qr_png for --profile
 
-    # Create metadata JSON
-    metadata = {
+    Called in the main process with what the workers returned, because
+    counters incremented inside worker processes are lost.
+    """
+    PROFILER.count("qr_cache_misses" if rendered else "qr_cache_hits")
+    if rendered:
+        PROFILER.count("qr_encodes")
+    PROFILER.count("files_written")
+
+
+def create_track_files(track, base_filename, qr_mode="url"):
+    """Create QR code for a track, reusing the cached image when there is one
+
+    Returns True if the code had to be encoded.
+    """
+    payload = qr_payload(track["external_urls"]["spotify"], qr_mode)
+    return create_qr_png(payload, f"{base_filename}.png", qr_mode)
+
+
+def build_track_metadata(track, track_id, base_filename, qr_mode="url"):
+    """Build the metadata store record for a track"""
+    spotify_url = track["external_urls"]["spotify"]
+    record = {
+        "id": track_id,
+        "qr_file": f"{os.path.basename(base_filename)}.png",
         "name": track["name"],
         "artists": [artist["name"] for artist in track["artists"]],
         "release_year": track["album"]["release_date"][:4],
         "album": track["album"]["name"],
+        "spotify_url": spotify_url,
+        # What the QR code encodes, so the PDF can encode exactly the same
+        "qr_payload": qr_payload(spotify_url, qr_mode),
+        "qr_mode": qr_mode,
+    }
+    # Clean up and wrap the label text once here instead of on every print
+    record.update(label_layout(record))
+    return record
+
+
+def track_inputs_hash(track, qr_mode="url"):
+    """Hash everything that ends up in a track's QR code and metadata"""
+    inputs = {
         "spotify_url": track["external_urls"]["spotify"],
+        "name": track["name"],
+        "artists": [artist["name"] for artist in track["artists"]],
+        "album": track["album"]["name"],
+        "release_date": track["album"]["release_date"],
+        "qr_settings": QR_MODES[qr_mode],
     }
+    encoded = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    """Load the track manifest, or an empty one if there is none yet"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest {path}: {e}")
+        return {}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    """Atomically write the track manifest"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    PROFILER.count("files_written")
+
+
+def is_up_to_date(entry, inputs_hash, base_filename):
+    """Check whether a manifest entry still matches the track and its files"""
+    return (
+        entry is not None
+        and entry["hash"] == inputs_hash
+        and entry["base_filename"] == base_filename
+        and os.path.exists(f"{base_filename}.png")
+    )
+
+
+def prune_removed_tracks(old_manifest, new_manifest):
+    """Delete files that no entry of the new manifest uses any more
+
+    This covers tracks no deck lists any longer and tracks whose files were
+    renamed.
+    """
+    in_use = {entry["base_filename"] for entry in new_manifest.values()}
+    removed = 0
+    for entry in old_manifest.values():
+        if entry["base_filename"] in in_use:
+            continue
+        # Also clean up per-track JSON files written by older versions
+        for extension in (".png", ".json"):
+            path = f"{entry['base_filename']}{extension}"
+            if os.path.exists(path):
+                os.remove(path)
+        removed += 1
+    return removed
+
+
+def generate_track_files(jobs, workers=1):
+    """Run create_track_files for (track, base_filename, qr_mode) jobs
+
+    Yields (job, rendered, error) in job order; rendered is what
+    create_track_files returned and error is None on success. With more than
+    one worker the tracks are generated in a process pool. A failing track
+    never stops the others.
+    """
+    if workers <= 1:
+        for job in jobs:
+            try:
+                yield job, create_track_files(*job), None
+            except Exception as e:
+                yield job, None, e
+        return
 
-    with open(f"{base_filename}.json", "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2, ensure_ascii=False)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(create_track_files, *job) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                yield job, future.result(), None
+            except Exception as e:
+                yield job, None, e
 
 
-def main():
+def load_playlist_index(user, index_dir=PLAYLIST_INDEX_DIR, ttl=PLAYLIST_INDEX_TTL):
+    """Load a user's playlist name to id index, or an empty one if it is stale"""
+    path = os.path.join(index_dir, f"playlist_index_{user}.json")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable playlist index {path}: {e}")
+        return {}
+    if time.time() - index.get("updated", 0) > ttl:
+        return {}
+    return index
+
+
+def save_playlist_index(user, index, index_dir=PLAYLIST_INDEX_DIR):
+    """Atomically write a user's playlist index"""
+    os.makedirs(index_dir, exist_ok=True)
+    path = os.path.join(index_dir, f"playlist_index_{user}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    PROFILER.count("files_written")
+
+
+def find_playlists(sp, user, names=None):
+    """Map the names of a user's playlists to their ids
+
+    With names given only those playlists are returned, otherwise all of them.
+    Lookups are answered from a persistent index; on a miss the listing is
+    paged through only until every name is found, and the index is updated.
+    The index is rebuilt once it is older than PLAYLIST_INDEX_TTL.
+    """
+    index = load_playlist_index(user)
+    playlists = index.get("playlists", {})
+    complete = index.get("complete", False)
+
+    if names is None:
+        missing = not complete
+    else:
+        missing = any(name not in playlists for name in names)
+
+    if missing:
+        # Rescan from the start, since playlists may have moved or been added
+        found = {}
+        results = sp.user_playlists(user)
+        while True:
+            for playlist in results["items"]:
+                # The first playlist with a name wins, as in the listing
+                found.setdefault(playlist["name"], playlist["id"])
+            complete = not results["next"]
+            if complete or (names is not None and all(name in found for name in names)):
+                break
+            results = sp.next(results)
+        if complete:
+            playlists, updated = found, time.time()
+        else:
+            # Names not reached this time are kept, but expire with the old index
+            playlists = {**playlists, **found}
+            updated = index.get("updated", time.time())
+        save_playlist_index(
+            user, {"updated": updated, "complete": complete, "playlists": playlists}
+        )
+
+    return {
+        name: playlist_id
+        for name, playlist_id in playlists.items()
+        if names is None or name in names
+    }
+
+
+def find_user_playlists(sp, users, names=None):
+    """Map playlist names to ids across the playlists of several users
+
+    Decks are stored by playlist name, so two different playlists with the
+    same name raise a ValueError instead of one silently replacing the other.
+    The same playlist showing up for several users is fine.
+    """
+    playlist_ids = {}
+    owners = {}
+    for user in users:
+        for name, playlist_id in find_playlists(sp, user, names).items():
+            if playlist_ids.get(name, playlist_id) != playlist_id:
+                raise ValueError(
+                    f"Users '{owners[name]}' and '{user}' both have a playlist "
+                    f"named '{name}'. Rename one of them or pass only one --user."
+                )
+            playlist_ids[name] = playlist_id
+            owners.setdefault(name, user)
+    return playlist_ids
+
+
+def fetch_playlists(sp, playlist_ids, use_async=False, cache_dir=PLAYLIST_CACHE_DIR):
+    """Fetch the tracks of several playlists at once, keyed like playlist_ids
+
+    Listings whose snapshot_id did not change come from the cache. With
+    use_async every changed listing is fetched in one asyncio session, so all
+    requests share its connection pool, its concurrency limit and its rate
+    limit backoff.
+    """
+    if use_async:
+        return fetch_playlists_async(sp, playlist_ids, cache_dir)
+
+    def fetch(playlist_id):
+        return get_playlist_tracks_cached(
+            sp, playlist_id, cache_dir, max_workers=FETCH_WORKERS
+        )
+
+    with ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS) as executor:
+        listings = executor.map(fetch, playlist_ids.values())
+        return dict(zip(playlist_ids, listings))
+
+
+def fetch_playlists_async(sp, playlist_ids, cache_dir=PLAYLIST_CACHE_DIR):
+    """fetch_playlists with the asyncio client for the listings that changed"""
+    # aiohttp is slow to import, only load it when it is used
+    from spotify_async import fetch_playlists_tracks, spotify_access_token
+
+    with ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS) as executor:
+        snapshot_ids = list(
+            executor.map(
+                lambda pid: playlist_snapshot_id(sp, pid), playlist_ids.values()
+            )
+        )
+
+    listings = {}
+    changed = {}
+    for (name, playlist_id), snapshot_id in zip(playlist_ids.items(), snapshot_ids):
+        tracks = read_cached_tracks(playlist_id, snapshot_id, cache_dir)
+        if tracks is None:
+            changed[name] = (playlist_id, snapshot_id)
+        else:
+            listings[name] = tracks
+
+    if changed:
+        fetched = fetch_playlists_tracks(
+            [playlist_id for playlist_id, _ in changed.values()],
+            spotify_access_token(),
+        )
+        for (name, (playlist_id, snapshot_id)), tracks in zip(changed.items(), fetched):
+            write_cached_tracks(playlist_id, snapshot_id, tracks, cache_dir)
+            listings[name] = tracks
+    return {name: listings[name] for name in playlist_ids}
+
+
+def collect_tracks(listings):
+    """Deduplicate the tracks of several playlists by Spotify track id
+
+    Returns (tracks, decks, shared): tracks maps each track id to the track and
+    its base filename in the order first seen, decks maps each playlist name
+    to its track ids, and shared counts tracks repeated across playlists.
+    Local files are left out, as they have no Spotify link.
+    """
+    tracks = {}
+    decks = {}
+    shared = 0
+    for playlist_name, items in listings.items():
+        deck = decks[playlist_name] = []
+        in_deck = set()
+        for item in items:
+            track = item["track"]
+            if track is None:
+                continue
+            # Local files have no Spotify id or link to put in a QR code
+            if not track.get("id") or "spotify" not in track["external_urls"]:
+                print(
+                    f"Skipping local file '{track['name']}' in '{playlist_name}', "
+                    "it has no Spotify link"
+                )
+                continue
+
+            track_name = track["name"]
+            safe_name = "".join(
+                x for x in track_name if x.isalnum() or x in (" ", "-", "_")
+            )
+            track_id = track["id"]
+            # Titles repeat (covers, remasters, "Intro"), so the id keeps
+            # different tracks from sharing a file
+            base_filename = f"qr_codes/{safe_name}_{track_id}"
+            if track_id in in_deck:
+                continue
+            in_deck.add(track_id)
+            deck.append(track_id)
+
+            # A track already seen in another playlist shares its files
+            if track_id in tracks:
+                shared += 1
+                continue
+            tracks[track_id] = (track, base_filename)
+    return tracks, decks, shared
+
+
+def main(
+    users=("goupher",),
+    playlist_names=("Schlickenriester 2",),
+    workers=1,
+    use_async=False,
+    qr_mode="url",
+):
+    """Generate QR codes and metadata for the given playlists of the given users
+
+    With playlist_names None every playlist of the users is used. Tracks are
+    generated once however many playlists they appear in; every playlist gets
+    a deck file in decks/ listing its tracks. Tracks of decks written by
+    earlier runs are kept until their deck file is deleted.
+    """
     # Create output directory
     if not os.path.exists("qr_codes"):
         os.makedirs("qr_codes")
@@ -62,39 +498,155 @@ def main():
     # Initialize Spotify client
     sp = setup_spotify()
 
-    # Get the specific playlist
-    playlists = sp.user_playlists("goupher")
-    playlist_id = None
-
-    for playlist in playlists["items"]:
-        if playlist["name"] == "Schlickenriester 2":
-            playlist_id = playlist["id"]
-            break
+    # Get the requested playlists
+    with PROFILER.stage("find_playlist"):
+        try:
+            playlist_ids = find_user_playlists(sp, users, playlist_names)
+        except ValueError as e:
+            print(e)
+            return
 
-    if playlist_id is None:
-        print("Playlist 'Schlickenriester 2' not found!")
+    for name in playlist_names or ():
+        if name not in playlist_ids:
+            print(f"Playlist '{name}' not found!")
+    if not playlist_ids:
         return
 
     # Get tracks and create QR codes
-    tracks = get_playlist_tracks(sp, playlist_id)
-    print(f"\nGenerating QR codes for {len(tracks)} tracks...")
+    with PROFILER.stage("fetch_tracks"):
+        listings = fetch_playlists(sp, playlist_ids, use_async=use_async)
+    total = sum(len(tracks) for tracks in listings.values())
+    print(f"\nGenerating QR codes for {total} tracks in {len(listings)} playlists...")
+
+    tracks, decks, shared = collect_tracks(listings)
+    manifest = load_manifest()
+    new_manifest = {}
+    records = []
+    jobs = []
+    job_ids = []
+    skipped = 0
 
-    for i, item in enumerate(tracks):
-        track = item["track"]
-        if track is None:
+    for track_id, (track, base_filename) in tracks.items():
+        inputs_hash = track_inputs_hash(track, qr_mode)
+        new_manifest[track_id] = {"hash": inputs_hash, "base_filename": base_filename}
+        records.append(build_track_metadata(track, track_id, base_filename, qr_mode))
+
+        if is_up_to_date(manifest.get(track_id), inputs_hash, base_filename):
+            skipped += 1
             continue
 
-        track_name = track["name"]
-        safe_name = "".join(
-            x for x in track_name if x.isalnum() or x in (" ", "-", "_")
-        )
-        base_filename = f"qr_codes/{safe_name}"
+        jobs.append((track, base_filename, qr_mode))
+        job_ids.append(track_id)
 
-        create_track_files(track, base_filename)
-        print(f"Created QR code and metadata for: {track_name}")
+    failed = 0
+    with PROFILER.stage("generate_qr_codes"):
+        results = generate_track_files(jobs, workers)
+        for n, (track_id, ((track, *_), rendered, error)) in enumerate(
+            zip(job_ids, results), 1
+        ):
+            if error is None:
+                count_qr_png(rendered)
+                print(f"[{n}/{len(jobs)}] Created QR code for: {track['name']}")
+            else:
+                # Keep any previous entry so the next run retries the track
+                if track_id in manifest:
+                    new_manifest[track_id] = manifest[track_id]
+                else:
+                    del new_manifest[track_id]
+                failed += 1
+                print(
+                    f"[{n}/{len(jobs)}] Failed to create files for {track['name']}: {error}"
+                )
+
+    with PROFILER.stage("write_metadata"):
+        for playlist_name, deck in decks.items():
+            write_deck(playlist_name, deck, playlist_id=playlist_ids[playlist_name])
+        # Only add records that have a QR code, so the front and back PDFs
+        # stay in step. Tracks of decks not fetched this run are kept.
+        merge_metadata_store(
+            record
+            for record in records
+            if os.path.exists(os.path.join("qr_codes", record["qr_file"]))
+        )
+        in_use = referenced_track_ids()
+        new_manifest = {
+            track_id: entry
+            for track_id, entry in {**manifest, **new_manifest}.items()
+            if track_id in in_use
+        }
+        removed = prune_removed_tracks(manifest, new_manifest)
+        save_manifest(new_manifest)
+        evicted = evict_qr_cache()
+    print(f"\nSkipped {skipped} unchanged tracks, removed {removed} old tracks.")
+    if evicted:
+        print(f"Evicted {evicted} least recently used QR codes from the cache.")
+    if shared:
+        print(f"{shared} tracks were shared between playlists and generated once.")
+    if failed:
+        print(f"{failed} tracks failed and will be retried on the next run.")
 
     print("\nDone! QR codes have been saved in the 'qr_codes' directory.")
 
 
+def cli(argv=None, prog=None):
+    """Command line entry point for fetching playlists and generating codes"""
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Generate QR codes and metadata for a Spotify playlist"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes generating QR codes (default: 1)",
+    )
+    parser.add_argument(
+        "--user",
+        dest="users",
+        action="append",
+        help="Spotify user whose playlists to use, may be repeated (default: goupher)",
+    )
+    parser.add_argument(
+        "--playlist",
+        dest="playlists",
+        action="append",
+        help="playlist name to turn into a deck, may be repeated "
+        "(default: Schlickenriester 2)",
+    )
+    parser.add_argument(
+        "--all-playlists",
+        action="store_true",
+        help="turn every playlist of the users into a deck",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="encode spotify: URIs at a fixed QR version instead of web links",
+    )
+    parser.add_argument(
+        "--async-fetch",
+        action="store_true",
+        help="fetch playlist pages with the asyncio client",
+    )
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile:
+        PROFILER.start(
+            cprofile=args.profile_functions, trace_memory=args.profile_memory
+        )
+    if args.all_playlists:
+        playlist_names = None
+    else:
+        playlist_names = args.playlists or ["Schlickenriester 2"]
+    main(
+        users=args.users or ["goupher"],
+        playlist_names=playlist_names,
+        workers=args.workers,
+        use_async=args.async_fetch,
+        qr_mode="compact" if args.compact else "url",
+    )
+    if args.profile:
+        PROFILER.write(args.profile)
+
+
 if __name__ == "__main__":
-    main()
+    cli()
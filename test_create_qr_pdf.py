@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from create_qr_pdf import card_matrix
+from qr_render import QR_MODES, qr_matrix, qr_payload
+from spotify_qr_downloader import create_qr_png
+
+URL = "https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC"
+
+
+@pytest.mark.parametrize("qr_mode", ["url", "compact"])
+@pytest.mark.parametrize("box_size", [10, 7])
+def test_cached_code_is_read_at_its_mode_box_size(
+    tmp_path, monkeypatch, qr_mode, box_size
+):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(QR_MODES[qr_mode], "box_size", box_size)
+    payload = qr_payload(URL, qr_mode)
+    assert create_qr_png(payload, str(tmp_path / "code.png"), qr_mode)
+
+    card = {"qr_payload": payload, "qr_mode": qr_mode}
+
+    assert np.array_equal(card_matrix(card), qr_matrix(payload, qr_mode))
@@ -4,6 +4,7 @@ from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import os
+from functools import lru_cache
 
 
 def register_custom_font(font_path, font_name):
@@ -21,6 +22,12 @@ def register_custom_font(font_path, font_name):
         return False
 
 
+@lru_cache(maxsize=4096)
+def measure_text_width(text, font_name, font_size):
+    """Measure text width in points from the font metrics"""
+    return pdfmetrics.stringWidth(text, font_name, font_size)
+
+
 def wrap_text_to_lines(text, font_name, font_size, max_width):
     """Wrap text to fit within max_width, breaking at spaces"""
     if not text:
@@ -34,13 +41,9 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
     current_line = ""
     
     for word in words:
-        # Create a canvas to measure text width
-        temp_canvas = canvas.Canvas("temp_measure.pdf", pagesize=(100, 100))
-        temp_canvas.setFont(font_name, font_size)
-        
         # Test if adding this word would exceed max_width
         test_line = current_line + (" " if current_line else "") + word
-        test_width = temp_canvas.stringWidth(test_line, font_name, font_size)
+        test_width = measure_text_width(test_line, font_name, font_size)
         
         if test_width <= max_width:
             current_line = test_line
@@ -53,9 +56,6 @@ def wrap_text_to_lines(text, font_name, font_size, max_width):
                 # Single word is too long, truncate it
                 lines.append(word[:30])  # Fallback truncation
                 current_line = ""
-        
-        temp_canvas.save()
-        os.remove("temp_measure.pdf")  # Clean up temp file
     
     # Add the last line if it has content
     if current_line:
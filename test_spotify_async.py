@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import unused_port
+
+from spotify_async import (
+    DEFAULT_RETRY_AFTER,
+    PAGE_SIZE,
+    AsyncSpotify,
+    SpotifyRateLimited,
+    fetch_playlists_tracks,
+    retry_after_seconds,
+)
+
+
+class FakeSpotifyServer:
+    """Local stand-in for the playlist tracks endpoint
+
+    Every entry of throttle answers one request with 429 and that
+    Retry-After value (None leaves the header out) before pages are served.
+    """
+
+    def __init__(self, playlists):
+        self.playlists = playlists
+        self.throttle = []
+        self.requests = []
+
+    async def tracks(self, request):
+        playlist_id = request.match_info["playlist_id"]
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query["limit"])
+        self.requests.append((playlist_id, offset, time.monotonic()))
+        if self.throttle:
+            retry_after = self.throttle.pop(0)
+            headers = {} if retry_after is None else {"Retry-After": retry_after}
+            return web.Response(status=429, headers=headers)
+        total = self.playlists[playlist_id]
+        items = [
+            {"track": {"id": f"{playlist_id}-{i}"}}
+            for i in range(offset, min(offset + limit, total))
+        ]
+        return web.json_response({"items": items, "total": total})
+
+
+@pytest.fixture
+def server():
+    """Run a FakeSpotifyServer on its own event loop in a background thread"""
+    fake = FakeSpotifyServer({"a": 2 * PAGE_SIZE + 50, "b": PAGE_SIZE, "empty": 0})
+    app = web.Application()
+    app.router.add_get("/v1/playlists/{playlist_id}/tracks", fake.tracks)
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    port = unused_port()
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    fake.base_url = f"http://127.0.0.1:{port}/v1"
+    yield fake
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def fetch(server, *playlist_ids, **client_options):
+    """Fetch playlists with one AsyncSpotify client against server"""
+
+    async def run():
+        async with AsyncSpotify("token", server.base_url, **client_options) as client:
+            return await asyncio.gather(
+                *(client.playlist_tracks(playlist_id) for playlist_id in playlist_ids)
+            )
+
+    return asyncio.run(run())
+
+
+def track_ids(tracks):
+    return [item["track"]["id"] for item in tracks]
+
+
+@pytest.mark.parametrize("playlist_id, size, pages", [("a", 250, 3), ("b", 100, 1)])
+def test_pages_are_fetched_once_and_kept_in_order(server, playlist_id, size, pages):
+    (tracks,) = fetch(server, playlist_id)
+
+    assert track_ids(tracks) == [f"{playlist_id}-{i}" for i in range(size)]
+    offsets = sorted(offset for _, offset, _ in server.requests)
+    assert offsets == [page * PAGE_SIZE for page in range(pages)]
+
+
+def test_empty_playlist_needs_one_request(server):
+    (tracks,) = fetch(server, "empty")
+
+    assert tracks == []
+    assert len(server.requests) == 1
+
+
+def test_rate_limited_request_is_retried_after_the_pause(server):
+    server.throttle = ["0.2"]
+
+    (tracks,) = fetch(server, "b")
+
+    assert track_ids(tracks) == [f"b-{i}" for i in range(PAGE_SIZE)]
+    (_, _, throttled), (_, _, retried) = server.requests
+    assert retried - throttled >= 0.19
+
+
+def test_pause_applies_to_every_request_of_the_client(server):
+    server.throttle = ["0.3"]
+
+    fetch(server, "a", "b", max_concurrency=1)
+
+    _, _, throttled = server.requests[0]
+    assert all(arrived - throttled >= 0.29 for _, _, arrived in server.requests[1:])
+
+
+def test_http_date_retry_after_is_honoured(server):
+    server.throttle = [formatdate(time.time() - 5, usegmt=True), None]
+
+    (tracks,) = fetch(server, "b")
+
+    assert len(tracks) == PAGE_SIZE
+    assert len(server.requests) == 3
+
+
+def test_gives_up_after_max_retries(server):
+    server.throttle = ["0"] * 10
+
+    with pytest.raises(SpotifyRateLimited):
+        fetch(server, "b", max_retries=2)
+    assert len(server.requests) == 3
+
+
+def test_playlists_are_fetched_in_one_session(server, monkeypatch):
+    sessions = []
+    enter = AsyncSpotify.__aenter__
+
+    async def counting_enter(self):
+        sessions.append(self)
+        return await enter(self)
+
+    monkeypatch.setattr(AsyncSpotify, "__aenter__", counting_enter)
+
+    listings = fetch_playlists_tracks(["a", "b", "empty"], "token", server.base_url)
+
+    assert [len(tracks) for tracks in listings] == [250, 100, 0]
+    assert len(sessions) == 1
+
+
+def test_retry_after_seconds_parses_both_forms():
+    assert retry_after_seconds("2") == 2
+    assert retry_after_seconds("0.5") == 0.5
+    assert retry_after_seconds(None) == DEFAULT_RETRY_AFTER
+    assert retry_after_seconds("soon") == DEFAULT_RETRY_AFTER
+    assert retry_after_seconds(formatdate(time.time() - 60, usegmt=True)) == 0
+    in_a_minute = retry_after_seconds(formatdate(time.time() + 60, usegmt=True))
+    assert 55 <= in_a_minute <= 60
@@ -0,0 +1,243 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from spotify_qr_downloader import (
+    PAGE_SIZE,
+    collect_tracks,
+    fetch_playlists,
+    find_user_playlists,
+    get_playlist_tracks,
+    get_playlist_tracks_cached,
+    setup_spotify,
+)
+
+
+class FakeSpotify:
+    """Serves playlists page by page the way spotipy returns them
+
+    total overrides the total reported on every page, to mimic a playlist
+    that shrinks while it is paged through. delay(offset) slows down single
+    pages so parallel fetches finish out of order.
+    """
+
+    def __init__(self, playlists, snapshot_id="snapshot-1", total=None, delay=None):
+        self.playlists = {
+            playlist_id: [{"track": {"id": f"{playlist_id}-{i}"}} for i in range(size)]
+            for playlist_id, size in playlists.items()
+        }
+        self.snapshot_id = snapshot_id
+        self.total = total
+        self.delay = delay
+        self.offsets = []
+        self.snapshot_requests = 0
+        self.lock = threading.Lock()
+
+    def playlist_tracks(self, playlist_id, limit=100, offset=0):
+        with self.lock:
+            self.offsets.append(offset)
+        if self.delay:
+            time.sleep(self.delay(offset))
+        items = self.playlists[playlist_id]
+        total = len(items) if self.total is None else self.total
+        end = offset + limit
+        return {
+            "items": items[offset:end],
+            "total": total,
+            "next": (playlist_id, end, limit) if end < total else None,
+        }
+
+    def next(self, results):
+        playlist_id, offset, limit = results["next"]
+        return self.playlist_tracks(playlist_id, limit=limit, offset=offset)
+
+    def playlist(self, playlist_id, fields=None):
+        assert fields == "snapshot_id"
+        with self.lock:
+            self.snapshot_requests += 1
+        return {"snapshot_id": self.snapshot_id}
+
+
+def track_ids(tracks):
+    return [item["track"]["id"] for item in tracks]
+
+
+@pytest.mark.parametrize("max_workers", [None, 4])
+@pytest.mark.parametrize(
+    "size, pages",
+    [(0, 1), (1, 1), (PAGE_SIZE, 1), (PAGE_SIZE + 1, 2), (2 * PAGE_SIZE + 50, 3)],
+)
+def test_pagination_requests_every_page_once(size, pages, max_workers):
+    sp = FakeSpotify({"pl": size})
+
+    tracks = get_playlist_tracks(sp, "pl", max_workers=max_workers)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(size)]
+    assert sorted(sp.offsets) == [page * PAGE_SIZE for page in range(pages)]
+
+
+def test_parallel_pages_keep_playlist_order():
+    # The second page finishes last
+    sp = FakeSpotify({"pl": 5 * PAGE_SIZE}, delay=lambda offset: 0.1 * (offset == 100))
+
+    tracks = get_playlist_tracks(sp, "pl", max_workers=4)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(5 * PAGE_SIZE)]
+
+
+def test_parallel_pages_stop_at_the_items_actually_there():
+    # The first page claims more tracks than the playlist still has
+    sp = FakeSpotify({"pl": 150}, total=300)
+
+    tracks = get_playlist_tracks(sp, "pl", max_workers=4)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(150)]
+    assert sorted(sp.offsets) == [0, 100, 200]
+
+
+def test_cache_miss_fetches_and_stores_the_listing(tmp_path):
+    sp = FakeSpotify({"pl": 150})
+
+    tracks = get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(150)]
+    with open(tmp_path / "pl.json", "r", encoding="utf-8") as f:
+        cached = json.load(f)
+    assert cached["snapshot_id"] == "snapshot-1"
+    assert cached["tracks"] == tracks
+
+
+def test_cache_hit_only_requests_the_snapshot_id(tmp_path):
+    sp = FakeSpotify({"pl": 150})
+    first = get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+    sp.offsets.clear()
+
+    second = get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+
+    assert second == first
+    assert sp.offsets == []
+    assert sp.snapshot_requests == 2
+
+
+def test_changed_snapshot_fetches_the_listing_again(tmp_path):
+    sp = FakeSpotify({"pl": 150})
+    get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+    sp.playlists["pl"] = sp.playlists["pl"][:20]
+    sp.snapshot_id = "snapshot-2"
+    sp.offsets.clear()
+
+    tracks = get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(20)]
+    assert sp.offsets == [0]
+    with open(tmp_path / "pl.json", "r", encoding="utf-8") as f:
+        assert json.load(f)["snapshot_id"] == "snapshot-2"
+
+
+def test_unreadable_cache_is_fetched_again(tmp_path):
+    (tmp_path / "pl.json").write_text("{not json", encoding="utf-8")
+    sp = FakeSpotify({"pl": 10})
+
+    tracks = get_playlist_tracks_cached(sp, "pl", cache_dir=tmp_path)
+
+    assert track_ids(tracks) == [f"pl-{i}" for i in range(10)]
+    assert sp.offsets == [0]
+
+
+def test_fetch_playlists_keys_listings_by_name(tmp_path):
+    sp = FakeSpotify({"a": 120, "b": 3})
+
+    listings = fetch_playlists(sp, {"A": "a", "B": "b"}, cache_dir=tmp_path)
+
+    assert list(listings) == ["A", "B"]
+    assert track_ids(listings["A"]) == [f"a-{i}" for i in range(120)]
+    assert track_ids(listings["B"]) == [f"b-{i}" for i in range(3)]
+
+
+def test_local_files_are_left_out_of_the_decks(capsys):
+    song = {"id": "s1", "name": "Song", "external_urls": {"spotify": "url"}}
+    local = {"id": None, "name": "Demo", "external_urls": {}, "is_local": True}
+
+    tracks, decks, shared = collect_tracks(
+        {"A": [{"track": song}, {"track": local}], "B": [{"track": song}]}
+    )
+
+    assert list(tracks) == ["s1"]
+    assert decks == {"A": ["s1"], "B": ["s1"]}
+    assert shared == 1
+    assert "Skipping local file 'Demo' in 'A'" in capsys.readouterr().out
+
+
+class FakeUsers:
+    """Serves one page of playlists per user"""
+
+    def __init__(self, playlists):
+        self.playlists = playlists
+
+    def user_playlists(self, user):
+        items = [{"name": name, "id": pid} for name, pid in self.playlists[user]]
+        return {"items": items, "next": None}
+
+
+def test_same_playlist_of_several_users_is_found_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sp = FakeUsers({"u1": [("Mix", "m"), ("A", "a")], "u2": [("Mix", "m")]})
+
+    assert find_user_playlists(sp, ["u1", "u2"]) == {"Mix": "m", "A": "a"}
+
+
+def test_different_playlists_with_one_name_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sp = FakeUsers({"u1": [("Mix", "m1")], "u2": [("Mix", "m2")]})
+
+    with pytest.raises(ValueError, match="Mix"):
+        find_user_playlists(sp, ["u1", "u2"], ["Mix"])
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """Answers the first request with 429, then serves an empty playlist"""
+
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if len(self.requests) == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"items": [], "total": 0, "next": None}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_rate_limited_request_is_retried(monkeypatch):
+    monkeypatch.setattr(ThrottlingHandler, "requests", [])
+    monkeypatch.setattr(
+        SpotifyClientCredentials, "get_access_token", lambda *args, **kwargs: "token"
+    )
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ThrottlingHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        sp = setup_spotify()
+        sp.prefix = f"http://127.0.0.1:{httpd.server_port}/v1/"
+
+        tracks = get_playlist_tracks(sp, "pl")
+    finally:
+        httpd.shutdown()
+        thread.join()
+
+    assert tracks == []
+    assert len(ThrottlingHandler.requests) == 2